@@ -96,6 +96,18 @@ class Purchase(BaseModel):
     verified_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class PurchaseDecision(BaseModel):
+    purchase_id: str
+    approved: bool
+
+class PurchaseVerificationBatch(BaseModel):
+    items: List[PurchaseDecision]
+
+class PayoutBatchRequest(BaseModel):
+    withdrawal_ids: Optional[List[str]] = None  # default: every pending request
+    created_before: Optional[datetime] = None
+    note: Optional[str] = None
+
 class Commission(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
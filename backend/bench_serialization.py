@@ -0,0 +1,101 @@
+"""Response serialization benchmark.
+
+Compares, per payload size, the CPU spent rendering a response body:
+
+    stdlib    FastAPI's default path for a returned dict:
+              jsonable_encoder + Starlette JSONResponse (stdlib json)
+    orjson    the same dict through jsonable_encoder + OrjsonResponse
+              (what routes returning plain dicts now get)
+    direct    OrjsonResponse returned by the route; no jsonable_encoder
+
+Payloads mimic /dashboard/admin/users pages and /chat/history message
+arrays (datetimes, ObjectId-derived strings, Indonesian text).
+
+    python bench_serialization.py [--sizes 10 100 1000 5000] [--repeat 20]
+"""
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from responses import OrjsonResponse
+from bson import ObjectId
+from datetime import datetime, timedelta
+import argparse
+import time
+
+def admin_users_payload(n: int) -> dict:
+    now = datetime.utcnow()
+    return {
+        "users": [
+            {
+                "id": str(ObjectId()),
+                "name": f"Pengguna {i}",
+                "phone_number": f"0812{i:08d}",
+                "role": "user",
+                "challenge_enrolled": i % 2 == 0,
+                "total_referrals": i % 7,
+                "total_commission": i * 1250.5,
+                "is_active": True,
+                "created_at": now - timedelta(minutes=i)
+            }
+            for i in range(n)
+        ],
+        "total": n,
+        "limit": n,
+        "next_cursor": None
+    }
+
+def chat_history_payload(n: int) -> dict:
+    now = datetime.utcnow()
+    text = "Perut saya sering kembung setelah makan, apa yang sebaiknya saya lakukan? " * 3
+    return {
+        "session_id": "session_bench",
+        "messages": [
+            {
+                "user_id": "bench",
+                "session_id": "session_bench",
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": text,
+                "timestamp": now - timedelta(seconds=n - i)
+            }
+            for i in range(n)
+        ],
+        "next_before": now - timedelta(seconds=n)
+    }
+
+def render_stdlib(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+def render_orjson(content) -> bytes:
+    return OrjsonResponse(jsonable_encoder(content)).body
+
+def render_direct(content) -> bytes:
+    return OrjsonResponse(content).body
+
+RENDERERS = {"stdlib": render_stdlib, "orjson": render_orjson, "direct": render_direct}
+
+def cpu_us(render, content, repeat: int) -> float:
+    render(content)
+    started = time.process_time()
+    for _ in range(repeat):
+        render(content)
+    return (time.process_time() - started) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON response rendering")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'payload':<14}{'rows':>6}{'bytes':>10}" + "".join(f"{name + ' us':>13}" for name in RENDERERS) + f"{'saved':>8}")
+    for name, build in (("admin_users", admin_users_payload), ("chat_history", chat_history_payload)):
+        for size in args.sizes:
+            content = build(size)
+            timings = {r: cpu_us(fn, content, args.repeat) for r, fn in RENDERERS.items()}
+            saved = 1 - timings["direct"] / timings["stdlib"]
+            print(
+                f"{name:<14}{size:>6}{len(render_direct(content)):>10}"
+                + "".join(f"{timings[r]:>13.1f}" for r in RENDERERS)
+                + f"{saved:>8.0%}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Key/value cache backends.
+
+`MemoryCacheBackend` is a per-process TTL + LRU map. `MongoCacheBackend`
+shares entries between workers through the `cache_entries` collection,
+whose TTL index (see indexes.py) removes expired documents. Values stored
+in the Mongo backend must be BSON-serializable.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Optional
+import time
+
+class CacheBackend:
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+class MongoCacheBackend(CacheBackend):
+    def __init__(self, collection: str = "cache_entries"):
+        self.collection = collection
+
+    def _collection(self):
+        from database import get_database
+        return get_database()[self.collection]
+
+    async def get(self, key: str) -> Optional[Any]:
+        doc = await self._collection().find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+            {"value": 1}
+        )
+        return doc["value"] if doc else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._collection().update_one(
+            {"_id": key},
+            {"$set": {"value": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    async def delete(self, key: str):
+        await self._collection().delete_one({"_id": key})
+
+def create_cache_backend(kind: str, max_entries: int = 1000) -> Optional[CacheBackend]:
+    """Build a backend from a config string: memory, mongo or none"""
+    if kind == "memory":
+        return MemoryCacheBackend(max_entries=max_entries)
+    if kind == "mongo":
+        return MongoCacheBackend()
+    return None
@@ -0,0 +1,169 @@
+"""Compact task state for the 30 Day Challenge.
+
+`challenges.day_tasks` holds 30 small ints, one per day; bit 0/1/2 marks
+the morning/noon/evening task as done. Check-ins set a bit with an atomic
+`$bit: {or: ...}`, so repeating one is a no-op, and progress, streak and
+next task are computed from at most 30 ints.
+
+Stored `current_day` and the active -> completed transition are advanced
+for all challenges at once by `advance_challenge_days`, which the
+scheduler runs periodically (see server.py); reads derive the day from
+`start_date` and never write.
+
+Challenges created before this layout carry a `completed_tasks` array;
+they are converted on first check-in or in bulk with:
+
+    python challenge_state.py migrate
+    python challenge_state.py advance
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne, UpdateMany
+from versions import bump_versions
+from dashboard_cache import dashboard_cache
+from datetime import datetime, timedelta
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOTAL_DAYS = 30
+TIMES = ["morning", "noon", "evening"]
+TASKS_PER_DAY = len(TIMES)
+TOTAL_TASKS = TOTAL_DAYS * TASKS_PER_DAY
+
+MIGRATE_BATCH_SIZE = 500
+
+def current_day_for(start_date: datetime, now: Optional[datetime] = None) -> int:
+    days_passed = ((now or datetime.utcnow()) - start_date).days + 1
+    return max(1, min(days_passed, TOTAL_DAYS))
+
+def empty_day_tasks() -> List[int]:
+    return [0] * TOTAL_DAYS
+
+def task_mask(time: str) -> int:
+    return 1 << TIMES.index(time)
+
+def day_tasks_from_legacy(completed_tasks: List[dict]) -> List[int]:
+    day_tasks = empty_day_tasks()
+    for task in completed_tasks:
+        day, time = task.get("day"), task.get("time")
+        if isinstance(day, int) and 1 <= day <= TOTAL_DAYS and time in TIMES:
+            day_tasks[day - 1] |= task_mask(time)
+    return day_tasks
+
+def day_tasks_of(challenge: dict) -> List[int]:
+    """Task state of a challenge document in either layout"""
+    if isinstance(challenge.get("day_tasks"), list):
+        return challenge["day_tasks"]
+    return day_tasks_from_legacy(challenge.get("completed_tasks", []))
+
+def completed_count(day_tasks: List[int]) -> int:
+    return sum(bin(mask).count("1") for mask in day_tasks)
+
+def streak_days(day_tasks: List[int]) -> int:
+    """Consecutive days with a completed task, ending at the latest such day"""
+    streak = 0
+    for mask in reversed(day_tasks):
+        if mask:
+            streak += 1
+        elif streak:
+            break
+    return streak
+
+def next_task(day_tasks: List[int], current_day: int) -> Optional[dict]:
+    """First open task of `current_day`, or None once all three are done"""
+    mask = day_tasks[current_day - 1]
+    for i, time in enumerate(TIMES):
+        if not mask & (1 << i):
+            return {
+                "day": current_day,
+                "time": time,
+                "task": f"Tugas {time} hari ke-{current_day}",
+                "completed": False
+            }
+    return None
+
+async def advance_challenge_days(db: AsyncIOMotorDatabase, now: Optional[datetime] = None) -> dict:
+    """Bring every active challenge's `current_day` up to date in one bulk_write.
+
+    One UpdateMany per challenge day selects the start_date window for that
+    day; challenges past their last day are marked completed. Filters skip
+    documents already in the right state, so reruns write nothing.
+    """
+    now = now or datetime.utcnow()
+    expired = {"status": "active", "start_date": {"$lte": now - timedelta(days=TOTAL_DAYS)}}
+    completing = await db.challenges.distinct("user_id", expired)
+    ops = [
+        UpdateMany(
+            expired,
+            {"$set": {"status": "completed", "current_day": TOTAL_DAYS, "completed_at": now, "updated_at": now}}
+        )
+    ]
+    for day in range(1, TOTAL_DAYS + 1):
+        window = {"$gt": now - timedelta(days=day), "$lte": now - timedelta(days=day - 1)}
+        if day == 1:
+            window = {"$gt": now - timedelta(days=1)}
+        ops.append(UpdateMany(
+            {"status": "active", "start_date": window, "current_day": {"$ne": day}},
+            {"$set": {"current_day": day, "updated_at": now}}
+        ))
+    result = await db.challenges.bulk_write(ops, ordered=True)
+    # Completed challenges drop out of the dashboard overview
+    await bump_versions(db, completing, "challenge", challenge_start=None)
+    await dashboard_cache.invalidate_many(completing, "overview")
+    return {"matched": result.matched_count, "modified": result.modified_count}
+
+async def migrate_challenge(db: AsyncIOMotorDatabase, challenge: dict):
+    await db.challenges.update_one(
+        {"_id": challenge["_id"], "day_tasks": {"$exists": False}},
+        {
+            "$set": {"day_tasks": day_tasks_from_legacy(challenge.get("completed_tasks", []))},
+            "$unset": {"completed_tasks": ""}
+        }
+    )
+
+async def migrate_challenges(db: AsyncIOMotorDatabase) -> int:
+    """Convert every legacy `completed_tasks` array with batched bulk_write"""
+    migrated = 0
+    batch = []
+    cursor = db.challenges.find(
+        {"day_tasks": {"$exists": False}},
+        {"completed_tasks": 1}
+    )
+    async for challenge in cursor:
+        batch.append(UpdateOne(
+            {"_id": challenge["_id"], "day_tasks": {"$exists": False}},
+            {
+                "$set": {"day_tasks": day_tasks_from_legacy(challenge.get("completed_tasks", []))},
+                "$unset": {"completed_tasks": ""}
+            }
+        ))
+        if len(batch) >= MIGRATE_BATCH_SIZE:
+            migrated += (await db.challenges.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        migrated += (await db.challenges.bulk_write(batch, ordered=False)).modified_count
+    logger.info(f"Migrated {migrated} challenges to day_tasks")
+    return migrated
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from database import connect_to_mongo, close_mongo_connection
+
+    parser = argparse.ArgumentParser(description="Maintain JATES9 challenge task state")
+    parser.add_argument("command", choices=["migrate", "advance"])
+    args = parser.parse_args()
+
+    async def main():
+        db = await connect_to_mongo()
+        try:
+            if args.command == "migrate":
+                print(await migrate_challenges(db))
+            else:
+                print(await advance_challenge_days(db))
+        finally:
+            close_mongo_connection()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
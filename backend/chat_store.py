@@ -0,0 +1,162 @@
+"""Append-only chat storage.
+
+Messages live one-per-document in `chat_messages`; the `chat_sessions`
+document only keeps metadata and counters, so each turn writes a constant
+number of bytes regardless of conversation length.
+
+Sessions written before this layout kept an embedded `messages` array.
+The `chat-migration` job (see server.py) moves them over once after
+deploy; it can also be run by hand:
+
+    python chat_store.py migrate
+
+Migrated messages are upserted on their position in the old array
+(`legacy_seq`, unique per session), so an interrupted migration or one
+running in several workers at once can simply be run again.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+MIGRATE_BATCH_SIZE = 1000
+MIGRATION_STATE_ID = "embedded_messages"
+DUPLICATE_KEY = 11000
+
+async def append_messages(db: AsyncIOMotorDatabase, user_id: str, session_id: str, messages: List[dict]):
+    """Insert new messages and bump the session counters in two writes"""
+    now = datetime.utcnow()
+    docs = []
+    previous = None
+    for m in messages:
+        # Mongo keeps millisecond precision; keep a turn's messages strictly
+        # ordered so paging on `timestamp < before` never splits a tie.
+        timestamp = m.get("timestamp", now)
+        timestamp = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+        if previous and timestamp <= previous:
+            timestamp = previous + timedelta(milliseconds=1)
+        previous = timestamp
+        docs.append({
+            "user_id": user_id,
+            "session_id": session_id,
+            "role": m["role"],
+            "content": m["content"],
+            "timestamp": timestamp
+        })
+    await db.chat_messages.insert_many(docs, ordered=True)
+    await db.chat_sessions.update_one(
+        {"user_id": user_id, "session_id": session_id},
+        {
+            "$inc": {"message_count": len(messages)},
+            "$set": {"updated_at": now, "last_message_at": now},
+            "$setOnInsert": {"created_at": now}
+        },
+        upsert=True
+    )
+
+async def is_first_turn(db: AsyncIOMotorDatabase, user_id: str, session_id: str) -> bool:
+    session = await db.chat_sessions.find_one(
+        {"user_id": user_id, "session_id": session_id},
+        {"message_count": 1, "messages": 1}
+    )
+    return not session or not (session.get("message_count") or session.get("messages"))
+
+async def latest_session_id(db: AsyncIOMotorDatabase, user_id: str) -> Optional[str]:
+    session = await db.chat_sessions.find_one(
+        {"user_id": user_id},
+        {"session_id": 1},
+        sort=[("updated_at", DESCENDING)]
+    )
+    return session["session_id"] if session else None
+
+async def get_messages(
+    db: AsyncIOMotorDatabase,
+    user_id: str,
+    session_id: str,
+    before: Optional[datetime] = None,
+    limit: int = 50
+) -> List[dict]:
+    """Newest `limit` messages older than `before`, returned oldest first"""
+    query = {"user_id": user_id, "session_id": session_id}
+    if before:
+        query["timestamp"] = {"$lt": before}
+    messages = await db.chat_messages.find(
+        query,
+        {"_id": 0, "role": 1, "content": 1, "timestamp": 1}
+    ).sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(limit).to_list(length=limit)
+    messages.reverse()
+    return messages
+
+async def migrate_embedded_messages(db: AsyncIOMotorDatabase) -> int:
+    """Move legacy embedded `messages` arrays into `chat_messages` (idempotent)"""
+    migrated = 0
+    cursor = db.chat_sessions.find(
+        {"messages.0": {"$exists": True}},
+        {"user_id": 1, "session_id": 1, "messages": 1}
+    ).sort("_id", ASCENDING)
+    async for session in cursor:
+        now = datetime.utcnow()
+        ops = [
+            UpdateOne(
+                {"user_id": session["user_id"], "session_id": session["session_id"], "legacy_seq": seq},
+                {"$setOnInsert": {
+                    "role": m["role"],
+                    "content": m["content"],
+                    "timestamp": m.get("timestamp") or now
+                }},
+                upsert=True
+            )
+            for seq, m in enumerate(session["messages"])
+        ]
+        for start in range(0, len(ops), MIGRATE_BATCH_SIZE):
+            try:
+                await db.chat_messages.bulk_write(ops[start:start + MIGRATE_BATCH_SIZE], ordered=False)
+            except BulkWriteError as e:
+                # Another worker inserted the same message first
+                if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                    raise
+        # Counted only by the pass that removes the array; turns appended
+        # since the layout change are already in message_count
+        result = await db.chat_sessions.update_one(
+            {"_id": session["_id"], "messages": {"$exists": True}},
+            {"$unset": {"messages": ""}, "$inc": {"message_count": len(ops)}}
+        )
+        migrated += result.modified_count
+    logger.info(f"Migrated {migrated} chat sessions")
+    return migrated
+
+async def migrate_chat_sessions(db: AsyncIOMotorDatabase) -> dict:
+    """Run the embedded message migration once after deploy; later runs are a single lookup"""
+    state = await db.chat_state.find_one({"_id": MIGRATION_STATE_ID})
+    if state:
+        return {"completed_at": state["completed_at"]}
+    migrated = await migrate_embedded_messages(db)
+    await db.chat_state.update_one(
+        {"_id": MIGRATION_STATE_ID},
+        {"$set": {"completed_at": datetime.utcnow(), "migrated": migrated}},
+        upsert=True
+    )
+    return {"migrated": migrated}
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from database import connect_to_mongo, close_mongo_connection
+
+    parser = argparse.ArgumentParser(description="Maintain JATES9 chat storage")
+    parser.add_argument("command", choices=["migrate"])
+    parser.parse_args()
+
+    async def main():
+        db = await connect_to_mongo()
+        try:
+            print(await migrate_embedded_messages(db))
+        finally:
+            close_mongo_connection()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
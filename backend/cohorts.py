@@ -0,0 +1,234 @@
+"""Precomputed cohort analytics for the admin dashboard.
+
+A cohort is health_type x enrollment week (the Monday of the challenge
+start_date). `refresh_cohort_rollups` runs nightly from the scheduler and
+is incremental:
+
+1. Users with check-ins or challenges created since the stored watermark
+   have their per-user summary in `cohort_members` recomputed (one
+   document per user: cohort, last check-in day, task and comfort totals).
+2. Every cohort touched in step 1, plus every cohort whose challenges are
+   still running, gets a rollup for today in `cohort_rollups`: retention
+   by challenge day, completion rate and average comfort.
+3. The watermark advances to the end of the processed window.
+
+The analytics endpoint reads `cohort_rollups` only. Rerunning a window is
+harmless, since members are recomputed rather than incremented:
+
+    python cohorts.py refresh
+    python cohorts.py rebuild
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne, DeleteOne, UpdateOne
+from bson import ObjectId
+from challenge_state import TOTAL_DAYS, current_day_for
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+COHORT_ROLLUP_LAG_SECONDS = float(os.getenv("COHORT_ROLLUP_LAG_SECONDS", "300"))
+COHORT_BATCH_SIZE = 500
+
+STATE_ID = "cohort_rollups"
+UNKNOWN_HEALTH_TYPE = "unknown"
+
+CohortKey = Tuple[str, datetime]
+
+def cohort_week(start_date: datetime) -> datetime:
+    day = datetime(start_date.year, start_date.month, start_date.day)
+    return day - timedelta(days=day.weekday())
+
+async def get_watermark(db: AsyncIOMotorDatabase) -> Optional[datetime]:
+    state = await db.rollup_state.find_one({"_id": STATE_ID})
+    return state.get("watermark") if state else None
+
+async def _touched_users(db: AsyncIOMotorDatabase, since: Optional[datetime], until: datetime) -> Set[str]:
+    window = {"$lt": until} if since is None else {"$gte": since, "$lt": until}
+    user_ids = set(await db.checkins.distinct("user_id", {"created_at": window}))
+    user_ids.update(await db.challenges.distinct("user_id", {"created_at": window}))
+    return {u for u in user_ids if isinstance(u, str)}
+
+async def _refresh_members(db: AsyncIOMotorDatabase, user_ids: List[str], now: datetime) -> Set[CohortKey]:
+    """Recompute member summaries for one batch; returns old and new cohorts"""
+    cohorts: Set[CohortKey] = set()
+    async for member in db.cohort_members.find({"_id": {"$in": user_ids}}, {"health_type": 1, "cohort_week": 1}):
+        cohorts.add((member["health_type"], member["cohort_week"]))
+
+    object_ids = [ObjectId(u) for u in user_ids if ObjectId.is_valid(u)]
+    health_types = {
+        str(u["_id"]): u.get("health_type") or UNKNOWN_HEALTH_TYPE
+        async for u in db.users.find({"_id": {"$in": object_ids}}, {"health_type": 1})
+    }
+    start_dates = {
+        row["_id"]: row["start_date"]
+        async for row in db.challenges.aggregate([
+            {"$match": {"user_id": {"$in": user_ids}, "status": {"$in": ["active", "completed"]}}},
+            {"$sort": {"start_date": -1}},
+            {"$group": {"_id": "$user_id", "start_date": {"$first": "$start_date"}}}
+        ])
+    }
+    all_tasks = {"$and": ["$morning_task_completed", "$noon_task_completed", "$evening_task_completed"]}
+    checkins = {
+        row["_id"]: row
+        async for row in db.checkins.aggregate([
+            {"$match": {"user_id": {"$in": user_ids}}},
+            {"$group": {
+                "_id": "$user_id",
+                "checkin_days": {"$sum": 1},
+                "last_day": {"$max": "$day"},
+                "full_days": {"$sum": {"$cond": [all_tasks, 1, 0]}},
+                "comfort_sum": {"$sum": "$comfort_level"}
+            }}
+        ])
+    }
+
+    ops = []
+    for user_id in user_ids:
+        start_date = start_dates.get(user_id)
+        if start_date is None:
+            ops.append(DeleteOne({"_id": user_id}))
+            continue
+        stats = checkins.get(user_id, {})
+        member = {
+            "health_type": health_types.get(user_id, UNKNOWN_HEALTH_TYPE),
+            "cohort_week": cohort_week(start_date),
+            "start_date": start_date,
+            "checkin_days": stats.get("checkin_days", 0),
+            "last_day": max(0, min(stats.get("last_day") or 0, TOTAL_DAYS)),
+            "full_days": stats.get("full_days", 0),
+            "comfort_sum": stats.get("comfort_sum", 0),
+            "updated_at": now
+        }
+        cohorts.add((member["health_type"], member["cohort_week"]))
+        ops.append(ReplaceOne({"_id": user_id}, member, upsert=True))
+    if ops:
+        await db.cohort_members.bulk_write(ops, ordered=False)
+    return cohorts
+
+def cohort_rollup(members: List[dict], now: datetime) -> dict:
+    """Retention by challenge day, completion rate and average comfort"""
+    size = len(members)
+    # Stored check-in days are not range-checked; bincount rejects negatives
+    last_days = np.clip(np.array([m["last_day"] for m in members], dtype=int), 0, TOTAL_DAYS)
+    reached = np.array([current_day_for(m["start_date"], now) for m in members], dtype=int)
+    # Reverse cumulative counts: [d] = members whose value is >= d
+    retained_at = np.cumsum(np.bincount(last_days, minlength=TOTAL_DAYS + 1)[::-1])[::-1]
+    eligible_at = np.cumsum(np.bincount(reached, minlength=TOTAL_DAYS + 1)[::-1])[::-1]
+
+    retention = []
+    for day in range(1, TOTAL_DAYS + 1):
+        eligible = int(eligible_at[day])
+        retained = int(retained_at[day])
+        retention.append({
+            "day": day,
+            "eligible": eligible,
+            "retained": retained,
+            "rate": round(retained / eligible * 100, 2) if eligible else None
+        })
+
+    # Members past the last day count toward completion; finishing means a day-30 check-in
+    finished = [m for m in members if (now - m["start_date"]).days >= TOTAL_DAYS]
+    checkin_days = sum(m["checkin_days"] for m in members)
+    return {
+        "members": size,
+        "finished_window": len(finished),
+        "completion_rate": round(
+            sum(1 for m in finished if m["last_day"] >= TOTAL_DAYS) / len(finished) * 100, 2
+        ) if finished else None,
+        "task_completion_rate": round(
+            sum(m["full_days"] for m in members) / checkin_days * 100, 2
+        ) if checkin_days else None,
+        "average_comfort": round(
+            sum(m["comfort_sum"] for m in members) / checkin_days, 2
+        ) if checkin_days else None,
+        "retention": retention
+    }
+
+async def _write_rollups(db: AsyncIOMotorDatabase, cohorts: Set[CohortKey], now: datetime) -> int:
+    date = datetime(now.year, now.month, now.day)
+    ops = []
+    for health_type, week in cohorts:
+        members = await db.cohort_members.find(
+            {"health_type": health_type, "cohort_week": week},
+            {"start_date": 1, "checkin_days": 1, "last_day": 1, "full_days": 1, "comfort_sum": 1}
+        ).to_list(length=None)
+        ops.append(UpdateOne(
+            {"health_type": health_type, "cohort_week": week, "date": date},
+            {"$set": {**cohort_rollup(members, now), "updated_at": now}},
+            upsert=True
+        ))
+    if ops:
+        await db.cohort_rollups.bulk_write(ops, ordered=False)
+    return len(ops)
+
+async def refresh_cohort_rollups(db: AsyncIOMotorDatabase, full: bool = False) -> dict:
+    """Process check-ins and enrollments since the watermark (all with `full`)"""
+    now = datetime.utcnow()
+    since = None if full else await get_watermark(db)
+    # Rows created just before `until` may still be in flight; the lag lets them land
+    until = now - timedelta(seconds=COHORT_ROLLUP_LAG_SECONDS)
+    if since is not None and since >= until:
+        return {"members": 0, "cohorts": 0, "watermark": since}
+
+    user_ids = sorted(await _touched_users(db, since, until))
+    cohorts: Set[CohortKey] = set()
+    for i in range(0, len(user_ids), COHORT_BATCH_SIZE):
+        cohorts |= await _refresh_members(db, user_ids[i:i + COHORT_BATCH_SIZE], now)
+
+    # Retention denominators move daily while a cohort's challenges run
+    running_since = cohort_week(now - timedelta(days=TOTAL_DAYS))
+    async for row in db.cohort_members.aggregate([
+        {"$match": {"cohort_week": {"$gte": running_since}}},
+        {"$group": {"_id": {"health_type": "$health_type", "cohort_week": "$cohort_week"}}}
+    ]):
+        cohorts.add((row["_id"]["health_type"], row["_id"]["cohort_week"]))
+
+    written = await _write_rollups(db, cohorts, now)
+    await db.rollup_state.update_one(
+        {"_id": STATE_ID},
+        {"$set": {"watermark": until, "last_run_at": now}},
+        upsert=True
+    )
+    logger.info(f"Cohort rollups: {len(user_ids)} members refreshed, {written} cohorts written")
+    return {"members": len(user_ids), "cohorts": written, "watermark": until}
+
+async def latest_rollups(
+    db: AsyncIOMotorDatabase,
+    health_type: Optional[str] = None,
+    weeks: int = 12
+) -> List[dict]:
+    """Newest rollup of each cohort enrolled in the last `weeks` weeks"""
+    match: Dict[str, object] = {"cohort_week": {"$gte": cohort_week(datetime.utcnow()) - timedelta(weeks=weeks)}}
+    if health_type:
+        match["health_type"] = health_type
+    return await db.cohort_rollups.aggregate([
+        {"$match": match},
+        {"$sort": {"date": -1}},
+        {"$group": {"_id": {"health_type": "$health_type", "cohort_week": "$cohort_week"}, "rollup": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$rollup"}},
+        {"$project": {"_id": 0}},
+        {"$sort": {"cohort_week": -1, "health_type": 1}}
+    ]).to_list(length=None)
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from database import connect_to_mongo, close_mongo_connection
+
+    parser = argparse.ArgumentParser(description="Maintain JATES9 cohort analytics rollups")
+    parser.add_argument("command", choices=["refresh", "rebuild"])
+    args = parser.parse_args()
+
+    async def main():
+        db = await connect_to_mongo()
+        try:
+            print(await refresh_cohort_rollups(db, full=args.command == "rebuild"))
+        finally:
+            close_mongo_connection()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
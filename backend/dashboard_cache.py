@@ -0,0 +1,205 @@
+"""Read-through cache for the user dashboard views.
+
+Each view (`overview`, `health_report`) is cached per user under
+`dashboard:{view}:{user_id}` in two tiers:
+
+    local     per-process TTL + LRU map (MemoryCacheBackend)
+    shared    optional backend shared by all workers, chosen with
+              DASHBOARD_CACHE_SHARED_BACKEND (mongo or none); any
+              CacheBackend works, so a MemoryCacheBackend can stand in
+              for it locally
+
+Entries are stored with the version they were built for (the view's
+ETag, derived from `user_versions` and the ledger). A lookup for another
+version is a miss, so a write handled by any worker, which bumps the
+version, is never answered from an older copy in this one.
+
+An entry is fresh for DASHBOARD_CACHE_TTL_SECONDS. For a further
+DASHBOARD_CACHE_STALE_SECONDS it is still served (a "stale serve") while
+a single background load refreshes it. Concurrent misses for one key
+share a single load, so an expired hot entry costs one query, not one per
+request.
+
+Write handlers also call `invalidate` after committing (check-ins,
+purchase verification, withdrawal processing and payouts, enrollment and
+referrals) to free the superseded entries right away. A load that was
+running when its key was invalidated still answers its callers but is
+not stored. With a shared backend, local copies live at most
+DASHBOARD_CACHE_LOCAL_TTL_SECONDS.
+"""
+from cache import CacheBackend, MemoryCacheBackend, create_cache_backend
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "300"))
+DASHBOARD_CACHE_STALE_SECONDS = float(os.getenv("DASHBOARD_CACHE_STALE_SECONDS", "60"))
+DASHBOARD_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_LOCAL_TTL_SECONDS", "5"))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "20000"))
+DASHBOARD_CACHE_SHARED_BACKEND = os.getenv("DASHBOARD_CACHE_SHARED_BACKEND", "none")
+
+VIEWS = ("overview", "health_report")
+
+class ViewCache:
+    def __init__(
+        self,
+        local: Optional[MemoryCacheBackend],
+        shared: Optional[CacheBackend] = None,
+        ttl: float = DASHBOARD_CACHE_TTL_SECONDS,
+        stale_ttl: float = DASHBOARD_CACHE_STALE_SECONDS,
+        local_ttl: float = DASHBOARD_CACHE_LOCAL_TTL_SECONDS
+    ):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.local_ttl = local_ttl
+        self._loading: Dict[Tuple[str, Optional[str]], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.superseded = 0
+        self.stale_serves = 0
+        self.coalesced = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and (self.local is not None or self.shared is not None)
+
+    @staticmethod
+    def key(view: str, user_id: str) -> str:
+        return f"dashboard:{view}:{user_id}"
+
+    async def _lookup(self, key: str, version: Optional[str]) -> Optional[dict]:
+        entry = await self.local.get(key) if self.local is not None else None
+        # A local copy of another version may be behind a write another
+        # worker already cached in the shared tier
+        if (entry is None or entry.get("version") != version) and self.shared is not None:
+            shared = await self.shared.get(key)
+            if shared is not None:
+                entry = shared
+                if self.local is not None:
+                    await self.local.set(key, entry, self._local_ttl(entry))
+        return entry
+
+    def _local_ttl(self, entry: dict) -> float:
+        remaining = entry["fresh_until"] + self.stale_ttl - time.time()
+        return min(remaining, self.local_ttl) if self.shared is not None else remaining
+
+    async def _store(self, key: str, version: Optional[str], value: Any):
+        entry = {"value": value, "version": version, "fresh_until": time.time() + self.ttl}
+        if self.shared is not None:
+            await self.shared.set(key, entry, self.ttl + self.stale_ttl)
+        if self.local is not None:
+            await self.local.set(key, entry, self._local_ttl(entry))
+
+    async def _delete(self, key: str):
+        if self.local is not None:
+            await self.local.delete(key)
+        if self.shared is not None:
+            await self.shared.delete(key)
+
+    async def _run(self, key: str, version: Optional[str], loader: Callable[[], Awaitable[Any]]) -> Any:
+        task = asyncio.current_task()
+        loading = (key, version)
+        try:
+            value = await loader()
+            self.loads += 1
+            if self._loading.get(loading) is task:
+                await self._store(key, version, value)
+                if self._loading.get(loading) is not task:
+                    # Invalidated while the store was in flight
+                    await self._delete(key)
+            return value
+        except Exception:
+            self.load_errors += 1
+            raise
+        finally:
+            if self._loading.get(loading) is task:
+                del self._loading[loading]
+
+    def _start_load(self, key: str, version: Optional[str], loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._loading.get((key, version))
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, version, loader))
+            self._loading[(key, version)] = task
+        else:
+            self.coalesced += 1
+        return task
+
+    async def get_or_load(
+        self,
+        view: str,
+        user_id: str,
+        loader: Callable[[], Awaitable[Any]],
+        version: Optional[str] = None
+    ) -> Any:
+        """Cached value of `version` of the user's `view`, loading it on a miss"""
+        if not self.enabled:
+            return await loader()
+        key = self.key(view, user_id)
+        entry = await self._lookup(key, version)
+        if entry is not None and entry.get("version") == version:
+            if entry["fresh_until"] > time.time():
+                self.hits += 1
+            else:
+                self.stale_serves += 1
+                if (key, version) not in self._loading:
+                    self._start_load(key, version, loader).add_done_callback(_log_refresh_error)
+            return entry["value"]
+        if entry is None:
+            self.misses += 1
+        else:
+            self.superseded += 1
+        # Shielded so a disconnecting client does not cancel a shared load
+        return await asyncio.shield(self._start_load(key, version, loader))
+
+    async def invalidate(self, user_id: str, *views: str):
+        """Drop the user's cached views (all of them by default)"""
+        for view in views or VIEWS:
+            key = self.key(view, user_id)
+            for loading in [k for k in self._loading if k[0] == key]:
+                del self._loading[loading]
+            await self._delete(key)
+            self.invalidations += 1
+
+    async def invalidate_many(self, user_ids: Iterable[str], *views: str):
+        for user_id in set(user_ids):
+            await self.invalidate(user_id, *views)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_serves + self.misses + self.superseded
+        return {
+            "enabled": self.enabled,
+            "shared_backend": type(self.shared).__name__ if self.shared is not None else None,
+            "ttl_seconds": self.ttl,
+            "stale_seconds": self.stale_ttl,
+            "hits": self.hits,
+            "stale_serves": self.stale_serves,
+            "misses": self.misses,
+            "superseded": self.superseded,
+            "hit_ratio": round((self.hits + self.stale_serves) / lookups, 4) if lookups else 0.0,
+            "stale_ratio": round(self.stale_serves / lookups, 4) if lookups else 0.0,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "coalesced_loads": self.coalesced,
+            "loads_in_flight": len(self._loading),
+            "invalidations": self.invalidations,
+            "local_entries": len(self.local) if self.local is not None else None,
+            "local_evictions": self.local.evictions if self.local is not None else None
+        }
+
+def _log_refresh_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Dashboard cache refresh failed; serving stale entry: {task.exception()}")
+
+dashboard_cache = ViewCache(
+    MemoryCacheBackend(max_entries=DASHBOARD_CACHE_MAX_ENTRIES),
+    create_cache_backend(DASHBOARD_CACHE_SHARED_BACKEND)
+)
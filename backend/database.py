@@ -1,17 +1,127 @@
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import Awaitable, Callable, Optional, TypeVar
+from pool_metrics import PoolMetricsListener
+import asyncio
+import logging
 import os
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+logger = logging.getLogger(__name__)
+
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 db_name = os.environ.get('DB_NAME', 'jates9')
-client = AsyncIOMotorClient(mongo_url)
-db = client[db_name]
+
+# Connection pool settings (per uvicorn worker)
+MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '50'))
+MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '5'))
+MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+
+# Multi-document transactions need a replica set or mongos. "auto" checks
+# the server at connect time; "true"/"false" force the choice
+TRANSACTIONS_MODE = os.environ.get('MONGO_TRANSACTIONS', 'auto').lower()
+TRANSACTIONS_ENABLED = TRANSACTIONS_MODE == 'true'
+
+T = TypeVar("T")
+
+pool_metrics = PoolMetricsListener()
+
+client: Optional[AsyncIOMotorClient] = None
+db: Optional[AsyncIOMotorDatabase] = None
+
+async def supports_transactions(client: AsyncIOMotorClient) -> bool:
+    """True for a replica set member or a mongos router"""
+    hello = await client.admin.command("hello")
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+def create_client() -> AsyncIOMotorClient:
+    """Build the Motor client with the configured pool settings"""
+    return AsyncIOMotorClient(
+        mongo_url,
+        maxPoolSize=MAX_POOL_SIZE,
+        minPoolSize=MIN_POOL_SIZE,
+        maxIdleTimeMS=MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=CONNECT_TIMEOUT_MS,
+        waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[pool_metrics]
+    )
+
+async def connect_to_mongo() -> AsyncIOMotorDatabase:
+    """Open the shared client, pre-warm its pool and detect transaction support"""
+    global client, db, TRANSACTIONS_ENABLED
+    if client is None:
+        client = create_client()
+        db = client[db_name]
+
+    # Concurrent pings force the pool to open MIN_POOL_SIZE connections now
+    # instead of on the first requests after startup.
+    warm = max(MIN_POOL_SIZE, 1)
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(warm)))
+    logger.info(f"MongoDB pool ready: {warm} connections warmed (max {MAX_POOL_SIZE})")
+
+    if TRANSACTIONS_MODE == 'auto':
+        TRANSACTIONS_ENABLED = await supports_transactions(client)
+        if not TRANSACTIONS_ENABLED:
+            logger.warning("MongoDB is a standalone server; multi-document writes run without transactions")
+    return db
+
+def close_mongo_connection():
+    """Close the shared client"""
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
 
 def get_database() -> AsyncIOMotorDatabase:
     """Dependency to get database instance"""
-    return db
\ No newline at end of file
+    if db is None:
+        raise RuntimeError("Database client is not initialized; call connect_to_mongo() first")
+    return db
+
+async def upsert_one(
+    collection: AsyncIOMotorCollection,
+    query: dict,
+    update: dict,
+    projection: Optional[dict] = None
+) -> dict:
+    """find_one_and_update(upsert=True) returning the document after the write.
+
+    Two concurrent upserts on a unique key can race; the loser gets a
+    DuplicateKeyError and is retried once, which then matches the winner.
+    """
+    for attempt in range(2):
+        try:
+            return await collection.find_one_and_update(
+                query,
+                update,
+                projection=projection,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            if attempt:
+                raise
+
+async def run_transaction(callback: Callable[..., Awaitable[T]]) -> T:
+    """Run `callback(session)` in a transaction, retrying transient errors.
+
+    The callback may run more than once, so it must read what it needs
+    through the session rather than rely on state loaded beforehand.
+    Without transaction support (a standalone server, or
+    MONGO_TRANSACTIONS=false) it runs once with `session=None`.
+    """
+    if not TRANSACTIONS_ENABLED:
+        return await callback(None)
+    async with await get_database().client.start_session() as session:
+        return await session.with_transaction(callback)
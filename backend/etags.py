@@ -0,0 +1,51 @@
+"""Weak ETags and If-None-Match handling for polled GET endpoints.
+
+Each endpoint builds its ETag from cheap version data (a document's
+`updated_at`, counters in `user_versions`, see versions.py) before doing
+the expensive part of the request, and answers 304 when the client
+already holds that version:
+
+    etag = weak_etag("health-report", user_id, versions.get("checkins", 0))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    ...
+    return tagged(body, etag)
+
+ETags are weak because bodies are only semantically equivalent (key
+order, compression). Every per-user ETag includes the user id, so a tag
+held for one account never matches another's data. `Cache-Control:
+private, no-cache` lets browsers keep the body but revalidate on every
+poll, and `Vary: Authorization` keeps one account's cached body from
+being revalidated with another account's token on a shared device.
+"""
+from fastapi import Request, Response
+from responses import OrjsonResponse
+from typing import Any
+import hashlib
+
+CACHE_CONTROL = "private, no-cache"
+CACHE_HEADERS = {"Cache-Control": CACHE_CONTROL, "Vary": "Authorization"}
+
+def weak_etag(*parts: Any) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison against If-None-Match (a list of tags or *)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    wanted = _opaque(etag)
+    return any(_opaque(tag) == wanted for tag in header.split(","))
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, **CACHE_HEADERS})
+
+def tagged(content: Any, etag: str) -> OrjsonResponse:
+    return OrjsonResponse(content, headers={"ETag": etag, **CACHE_HEADERS})
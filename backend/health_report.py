@@ -0,0 +1,129 @@
+"""Health report for the 30 Day Challenge dashboard.
+
+Counts and averages come from a single `$group` over the user's check-ins,
+which also returns the day-ordered comfort and symptom series. Trend
+analytics over those series (rolling average, slope, week-over-week change,
+symptoms that became less frequent) are computed with NumPy.
+
+Built reports are cached per user and check-in version by the dashboard
+view cache (see dashboard_cache.py).
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import List
+import numpy as np
+
+TREND_WINDOW = 7
+
+LATEST_CHECKIN_FIELDS = [
+    "day", "date", "comfort_level", "symptoms", "notes",
+    "morning_task_completed", "noon_task_completed", "evening_task_completed"
+]
+
+def checkin_stats_pipeline(user_id: str) -> List[dict]:
+    all_tasks = {"$and": ["$morning_task_completed", "$noon_task_completed", "$evening_task_completed"]}
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"day": 1}},
+        {"$group": {
+            "_id": None,
+            "total_days": {"$sum": 1},
+            "full_days": {"$sum": {"$cond": [all_tasks, 1, 0]}},
+            "average_comfort": {"$avg": "$comfort_level"},
+            "comfort_trend": {"$push": "$comfort_level"},
+            "symptoms": {"$push": {"$ifNull": ["$symptoms", []]}},
+            "latest_checkin": {"$last": {f: f"${f}" for f in LATEST_CHECKIN_FIELDS}}
+        }}
+    ]
+
+def achievements_for(total_days: int, completion_rate: float) -> List[str]:
+    achievements = []
+    if total_days >= 7:
+        achievements.append("week_1")
+    if total_days >= 14:
+        achievements.append("week_2")
+    if total_days >= 21:
+        achievements.append("week_3")
+    if total_days >= 30:
+        achievements.append("champion")
+    if completion_rate >= 90:
+        achievements.append("perfectionist")
+    return achievements
+
+def comfort_trends(comfort: List[int], window: int = TREND_WINDOW) -> dict:
+    """Rolling average, per-day slope and week-over-week change of comfort"""
+    series = np.asarray(comfort, dtype=float)
+    n = len(series)
+    if n == 0:
+        return {"rolling_average": [], "slope": 0.0, "week_over_week_change": None}
+
+    # Trailing mean over up to `window` check-ins, via cumulative sums
+    cumsum = np.concatenate(([0.0], np.cumsum(series)))
+    ends = np.arange(1, n + 1)
+    starts = np.maximum(ends - window, 0)
+    rolling = (cumsum[ends] - cumsum[starts]) / (ends - starts)
+
+    slope = float(np.polyfit(np.arange(n), series, 1)[0]) if n >= 2 else 0.0
+    week_over_week = None
+    if n >= 2 * window:
+        week_over_week = float(series[-window:].mean() - series[-2 * window:-window].mean())
+
+    return {
+        "rolling_average": np.round(rolling, 2).tolist(),
+        "slope": round(slope, 4),
+        "week_over_week_change": round(week_over_week, 2) if week_over_week is not None else None
+    }
+
+def symptoms_reduced(symptoms: List[List[str]], window: int = TREND_WINDOW) -> List[str]:
+    """Symptoms reported less often in the latest check-ins than in the first ones.
+
+    Compares per-check-in frequency over the first and last `window`
+    check-ins (halves of the series when it is shorter than two windows).
+    """
+    n = len(symptoms)
+    if n < 2:
+        return []
+    names = sorted({s for day in symptoms for s in day})
+    if not names:
+        return []
+    index = {name: i for i, name in enumerate(names)}
+    present = np.zeros((n, len(names)), dtype=bool)
+    for row, day in enumerate(symptoms):
+        present[row, [index[s] for s in set(day)]] = True
+
+    span = min(window, n // 2)
+    early = present[:span].mean(axis=0)
+    recent = present[-span:].mean(axis=0)
+    reduced = np.flatnonzero(recent < early)
+    # Largest drop first
+    reduced = reduced[np.argsort(recent[reduced] - early[reduced], kind="stable")]
+    return [names[i] for i in reduced]
+
+def empty_report() -> dict:
+    return {
+        "total_days": 0,
+        "completion_rate": 0,
+        "average_comfort": 0,
+        "comfort_trend": [],
+        "achievements": [],
+        "symptoms_reduced": [],
+        "trends": comfort_trends([]),
+        "latest_checkin": None
+    }
+
+async def build_health_report(db: AsyncIOMotorDatabase, user_id: str) -> dict:
+    stats = await db.checkins.aggregate(checkin_stats_pipeline(user_id)).to_list(length=1)
+    if not stats or not stats[0]["total_days"]:
+        return empty_report()
+    stats = stats[0]
+    total_days = stats["total_days"]
+    completion_rate = stats["full_days"] / total_days * 100
+    return {
+        "total_days": total_days,
+        "completion_rate": round(completion_rate, 2),
+        "average_comfort": round(stats["average_comfort"] or 0, 2),
+        "comfort_trend": stats["comfort_trend"],
+        "achievements": achievements_for(total_days, completion_rate),
+        "symptoms_reduced": symptoms_reduced(stats["symptoms"]),
+        "trends": comfort_trends(stats["comfort_trend"]),
+        "latest_checkin": stats["latest_checkin"]
+    }
@@ -0,0 +1,219 @@
+"""MongoDB index registry.
+
+Every index the routes rely on is declared here and created by
+`ensure_indexes` at startup (see server.py) or from the command line:
+
+    python indexes.py ensure
+    python indexes.py report
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from typing import Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("phone_number", ASCENDING)], name="phone_number_unique", unique=True),
+        IndexModel(
+            [("referral_code", ASCENDING)],
+            name="referral_code_unique",
+            unique=True,
+            partialFilterExpression={"referral_code": {"$type": "string"}}
+        ),
+        IndexModel([("referred_by", ASCENDING)], name="referred_by"),
+        IndexModel(
+            [("user_id", ASCENDING)],
+            name="user_id_unique",
+            unique=True,
+            partialFilterExpression={"user_id": {"$type": "string"}}
+        ),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+        IndexModel([("role", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="role_created_at_id"),
+        IndexModel(
+            [("challenge_enrolled", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="challenge_enrolled_created_at_id"
+        ),
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="is_active_created_at_id"),
+    ],
+    "quiz_results": [
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="user_id_timestamp"),
+    ],
+    "challenges": [
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_id_status"),
+        IndexModel(
+            [("user_id", ASCENDING)],
+            name="user_id_active_unique",
+            unique=True,
+            partialFilterExpression={"status": "active"}
+        ),
+        IndexModel([("status", ASCENDING), ("start_date", ASCENDING)], name="status_start_date"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "checkins": [
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], name="user_id_day_unique", unique=True),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "purchases": [
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_id_status"),
+    ],
+    "commissions": [
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_id_status"),
+        IndexModel(
+            [("purchase_id", ASCENDING)],
+            name="purchase_id_unique",
+            unique=True,
+            partialFilterExpression={"purchase_id": {"$type": "string"}}
+        ),
+    ],
+    "withdrawal_requests": [
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_id_status"),
+        IndexModel(
+            [("payout_batch_id", ASCENDING), ("_id", ASCENDING)],
+            name="payout_batch_id",
+            partialFilterExpression={"payout_batch_id": {"$exists": True}}
+        ),
+    ],
+    "chat_sessions": [
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING)], name="user_id_session_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING)], name="user_id_updated_at"),
+    ],
+    "cache_entries": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "chat_messages": [
+        IndexModel(
+            [("user_id", ASCENDING), ("session_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="user_id_session_id_timestamp"
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("session_id", ASCENDING), ("legacy_seq", ASCENDING)],
+            name="user_id_session_id_legacy_seq_unique",
+            unique=True,
+            partialFilterExpression={"legacy_seq": {"$exists": True}}
+        ),
+    ],
+    "cohort_members": [
+        IndexModel([("health_type", ASCENDING), ("cohort_week", ASCENDING)], name="health_type_cohort_week"),
+        IndexModel([("cohort_week", ASCENDING)], name="cohort_week"),
+    ],
+    "cohort_rollups": [
+        IndexModel(
+            [("health_type", ASCENDING), ("cohort_week", ASCENDING), ("date", DESCENDING)],
+            name="health_type_cohort_week_date_unique",
+            unique=True
+        ),
+        IndexModel([("cohort_week", ASCENDING), ("date", DESCENDING)], name="cohort_week_date"),
+    ],
+}
+
+# Representative shape of each hot query issued by the routes, used by
+# `index_report` to check the winning plan. Values are placeholders; only
+# the filter/sort shape matters to the planner.
+ROUTE_QUERIES = [
+    {"route": "auth.login", "collection": "users", "filter": {"phone_number": ""}},
+    {"route": "auth.register.referrer", "collection": "users", "filter": {"referral_code": ""}},
+    {"route": "quiz.submit", "collection": "users", "filter": {"phone_number": ""}},
+    {"route": "quiz.result", "collection": "quiz_results", "filter": {"user_id": ""}},
+    {"route": "challenge.progress", "collection": "challenges", "filter": {"user_id": "", "status": "active"}},
+    {"route": "dashboard.overview.referrals", "collection": "users", "filter": {"referred_by": ""}},
+    {"route": "referrals.downline", "collection": "users", "filter": {"referred_by": {"$in": [""]}}},
+    {"route": "referrals.ancestors", "collection": "users", "filter": {"user_id": {"$in": [""]}}},
+    {"route": "dashboard.overview.purchases", "collection": "purchases", "filter": {"user_id": "", "status": "verified"}},
+    {"route": "dashboard.overview.commissions", "collection": "commissions", "filter": {"user_id": "", "status": "pending"}},
+    {"route": "dashboard.health_report", "collection": "checkins", "filter": {"user_id": ""}, "sort": {"day": 1}},
+    {"route": "dashboard.checkin", "collection": "checkins", "filter": {"user_id": "", "day": 1}},
+    {"route": "admin.users", "collection": "users", "filter": {}, "sort": {"created_at": -1, "_id": -1}},
+    {"route": "admin.users.role", "collection": "users", "filter": {"role": "admin"}, "sort": {"created_at": -1, "_id": -1}},
+    {"route": "admin.purchases", "collection": "purchases", "filter": {"status": "pending"}, "sort": {"created_at": -1}},
+    {"route": "admin.withdrawals", "collection": "withdrawal_requests", "filter": {"status": "pending"}, "sort": {"created_at": -1}},
+    {"route": "admin.analytics.cohorts", "collection": "cohort_rollups", "filter": {"cohort_week": {"$gte": ""}}, "sort": {"date": -1}},
+    {"route": "jobs.cohorts.checkins", "collection": "checkins", "filter": {"created_at": {"$gte": "", "$lt": ""}}},
+    {"route": "admin.payouts.csv", "collection": "withdrawal_requests", "filter": {"payout_batch_id": ""}, "sort": {"_id": 1}},
+    {"route": "chat.message", "collection": "chat_sessions", "filter": {"user_id": "", "session_id": ""}},
+    {"route": "chat.history", "collection": "chat_sessions", "filter": {"user_id": ""}, "sort": {"updated_at": -1}},
+    {
+        "route": "chat.history.messages",
+        "collection": "chat_messages",
+        "filter": {"user_id": "", "session_id": ""},
+        "sort": {"timestamp": -1, "_id": -1}
+    },
+]
+
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> Dict[str, List[str]]:
+    """Create every registered index; existing ones are left untouched.
+
+    A failure on one collection (e.g. duplicate data blocking a unique
+    index) is logged and does not stop the remaining collections.
+    """
+    created = {}
+    for collection, models in INDEXES.items():
+        try:
+            created[collection] = await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            logger.error(f"Could not ensure indexes on {collection}: {e}")
+    return created
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage")]
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        stages.extend(_plan_stages(child))
+    return [s for s in stages if s]
+
+async def index_report(db: AsyncIOMotorDatabase) -> dict:
+    """Index usage from $indexStats plus the winning plan of each route query"""
+    usage = {}
+    for collection in INDEXES:
+        stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        usage[collection] = {
+            s["name"]: s.get("accesses", {}).get("ops", 0)
+            for s in stats
+        }
+
+    queries = []
+    for query in ROUTE_QUERIES:
+        command = {"find": query["collection"], "filter": query["filter"]}
+        if "sort" in query:
+            command["sort"] = query["sort"]
+        explain = await db.command("explain", command, verbosity="queryPlanner")
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        queries.append({
+            "route": query["route"],
+            "collection": query["collection"],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+
+    return {
+        "index_usage": usage,
+        "queries": queries,
+        "collscans": [q["route"] for q in queries if q["collscan"]]
+    }
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import json
+    from database import connect_to_mongo, close_mongo_connection
+
+    parser = argparse.ArgumentParser(description="Manage JATES9 MongoDB indexes")
+    parser.add_argument("command", choices=["ensure", "report"])
+    args = parser.parse_args()
+
+    async def main():
+        db = await connect_to_mongo()
+        try:
+            if args.command == "ensure":
+                result = await ensure_indexes(db)
+            else:
+                result = await index_report(db)
+            print(json.dumps(result, indent=2, default=str))
+        finally:
+            close_mongo_connection()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
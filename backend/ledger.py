@@ -0,0 +1,248 @@
+"""Per-user financial ledger summary.
+
+One document per user in `user_ledgers` (keyed by the user id string)
+holds running totals that the write handlers keep current with `$inc`:
+
+    total_spent           verified purchases made by the user
+    commission_pending    commissions awaiting approval
+    commission_approved   commissions approved (lifetime)
+    commission_withdrawn  withdrawals paid out
+    withdrawal_pending    withdrawals requested but not yet processed
+    referral_count        direct referrals
+
+Every write also increments `rev`. `rebuild_ledgers` recomputes the
+summaries from `purchases`, `commissions`, `withdrawal_requests` and
+`users` and replaces a ledger only if its `rev` is unchanged since the
+run started, so a live `$inc` is never overwritten; those ledgers are
+reported as skipped and left for the next run:
+
+    python ledger.py reconcile
+
+Ledgers created before this collection existed are built once by the
+`ledger-backfill` job (see server.py); until it reaches a user,
+`reserve_withdrawal` rebuilds that user's ledger on demand.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FIELDS = (
+    "total_spent",
+    "commission_pending",
+    "commission_approved",
+    "commission_withdrawn",
+    "withdrawal_pending",
+    "referral_count",
+)
+
+RECONCILE_BATCH_SIZE = 1000
+BACKFILL_STATE_ID = "backfill"
+BACKFILL_ATTEMPTS = 3
+DUPLICATE_KEY = 11000
+
+def empty_ledger() -> Dict[str, float]:
+    return {field: 0 if field == "referral_count" else 0.0 for field in LEDGER_FIELDS}
+
+def ledger_update(deltas: Dict[str, float], now: datetime) -> dict:
+    """Update document that adds `deltas` and bumps the ledger revision"""
+    return {"$inc": {**deltas, "rev": 1}, "$set": {"updated_at": now}}
+
+def available_balance(ledger: dict) -> float:
+    """Approved commission that is neither withdrawn nor reserved by a request"""
+    return (
+        ledger.get("commission_approved", 0.0)
+        - ledger.get("commission_withdrawn", 0.0)
+        - ledger.get("withdrawal_pending", 0.0)
+    )
+
+async def get_ledger(db: AsyncIOMotorDatabase, user_id: str) -> dict:
+    return ledger_from_doc(await db.user_ledgers.find_one({"_id": user_id}))
+
+def ledger_from_doc(doc: Optional[dict]) -> dict:
+    ledger = empty_ledger()
+    if doc:
+        ledger.update({field: doc.get(field, ledger[field]) for field in LEDGER_FIELDS})
+    return ledger
+
+async def apply_ledger_delta(db: AsyncIOMotorDatabase, user_id: str, session=None, **deltas):
+    """Atomically add `deltas` to a user's ledger, creating it if missing"""
+    unknown = set(deltas) - set(LEDGER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown ledger fields: {sorted(unknown)}")
+    await db.user_ledgers.update_one(
+        {"_id": user_id},
+        ledger_update(deltas, datetime.utcnow()),
+        upsert=True,
+        session=session
+    )
+
+async def _reserve(db: AsyncIOMotorDatabase, user_id: str, amount: float) -> bool:
+    result = await db.user_ledgers.update_one(
+        {
+            "_id": user_id,
+            "$expr": {
+                "$gte": [
+                    {"$subtract": [
+                        {"$ifNull": ["$commission_approved", 0]},
+                        {"$add": [
+                            {"$ifNull": ["$commission_withdrawn", 0]},
+                            {"$ifNull": ["$withdrawal_pending", 0]}
+                        ]}
+                    ]},
+                    amount
+                ]
+            }
+        },
+        ledger_update({"withdrawal_pending": amount}, datetime.utcnow())
+    )
+    return result.modified_count == 1
+
+async def reserve_withdrawal(db: AsyncIOMotorDatabase, user_id: str, amount: float) -> bool:
+    """Reserve `amount` against the available balance in one conditional update"""
+    if await _reserve(db, user_id, amount):
+        return True
+    if await db.user_ledgers.find_one({"_id": user_id}, {"_id": 1}):
+        return False
+    # Not backfilled yet; build it from the source collections and retry
+    await rebuild_ledgers(db, [user_id])
+    return await _reserve(db, user_id, amount)
+
+async def _write_ledgers(db: AsyncIOMotorDatabase, ops: List[ReplaceOne]):
+    """Run conditional replaces; an insert that lost to a live upsert is skipped"""
+    try:
+        await db.user_ledgers.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+
+async def _rebuild(db: AsyncIOMotorDatabase, user_ids: Optional[List[str]]) -> Tuple[dict, List[str]]:
+    started_at = datetime.utcnow()
+    ledgers: Dict[str, dict] = {}
+
+    def scoped(field: str, match: dict) -> dict:
+        return {**match, field: {"$in": user_ids}} if user_ids is not None else match
+
+    def ledger_for(user_id) -> dict:
+        key = str(user_id)
+        if key not in ledgers:
+            ledgers[key] = empty_ledger()
+        return ledgers[key]
+
+    # Revisions are read before the sources, so any write racing the
+    # aggregation below moves the revision and cancels that replacement
+    revs = {
+        doc["_id"]: doc.get("rev")
+        async for doc in db.user_ledgers.find(scoped("_id", {}), {"rev": 1})
+    }
+
+    async for row in db.purchases.aggregate([
+        {"$match": scoped("user_id", {"status": "verified"})},
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$amount"}}}
+    ]):
+        ledger_for(row["_id"])["total_spent"] = row["total"]
+
+    async for row in db.commissions.aggregate([
+        {"$match": scoped("user_id", {"status": {"$in": ["pending", "approved"]}})},
+        {"$group": {"_id": {"user_id": "$user_id", "status": "$status"}, "total": {"$sum": "$amount"}}}
+    ]):
+        ledger_for(row["_id"]["user_id"])[f"commission_{row['_id']['status']}"] = row["total"]
+
+    async for row in db.withdrawal_requests.aggregate([
+        {"$match": scoped("user_id", {"status": {"$in": ["pending", "paid"]}})},
+        {"$group": {"_id": {"user_id": "$user_id", "status": "$status"}, "total": {"$sum": "$amount"}}}
+    ]):
+        field = "commission_withdrawn" if row["_id"]["status"] == "paid" else "withdrawal_pending"
+        ledger_for(row["_id"]["user_id"])[field] = row["total"]
+
+    async for row in db.users.aggregate([
+        {"$match": scoped("referred_by", {"referred_by": {"$type": "string"}})},
+        {"$group": {"_id": "$referred_by", "count": {"$sum": 1}}}
+    ]):
+        ledger_for(row["_id"])["referral_count"] = row["count"]
+
+    ops = [
+        ReplaceOne(
+            {"_id": user_id, "rev": revs.get(user_id)},
+            {**totals, "rev": (revs.get(user_id) or 0) + 1, "updated_at": started_at, "reconciled_at": started_at},
+            upsert=user_id not in revs
+        )
+        for user_id, totals in ledgers.items()
+    ]
+    for i in range(0, len(ops), RECONCILE_BATCH_SIZE):
+        await _write_ledgers(db, ops[i:i + RECONCILE_BATCH_SIZE])
+
+    # Ledgers left without any activity are removed under the same check
+    removed = 0
+    stale = [DeleteOne({"_id": user_id, "rev": rev}) for user_id, rev in revs.items() if user_id not in ledgers]
+    for i in range(0, len(stale), RECONCILE_BATCH_SIZE):
+        removed += (await db.user_ledgers.bulk_write(stale[i:i + RECONCILE_BATCH_SIZE], ordered=False)).deleted_count
+
+    skipped = [
+        doc["_id"]
+        async for doc in db.user_ledgers.find(
+            scoped("_id", {"reconciled_at": {"$ne": started_at}}), {"_id": 1}
+        )
+        if doc["_id"] in ledgers
+    ]
+    result = {
+        "rebuilt": len(ledgers) - len(skipped),
+        "removed": removed,
+        "skipped": len(skipped)
+    }
+    return result, skipped
+
+async def rebuild_ledgers(db: AsyncIOMotorDatabase, user_ids: Optional[List[str]] = None) -> dict:
+    """Recompute the ledgers of `user_ids` (all users by default) from the source collections.
+
+    Totals are grouped server-side and written back with batched ReplaceOne
+    upserts conditioned on the ledger revision read at the start; ledgers
+    with a live write during the run are skipped rather than overwritten.
+    """
+    result, _ = await _rebuild(db, user_ids)
+    logger.info(f"Rebuilt {result['rebuilt']} ledgers, removed {result['removed']} stale, skipped {result['skipped']}")
+    return result
+
+async def backfill_ledgers(db: AsyncIOMotorDatabase) -> dict:
+    """Build every ledger once after deploy; later runs are a single lookup"""
+    state = await db.ledger_state.find_one({"_id": BACKFILL_STATE_ID})
+    if state:
+        return {"completed_at": state["completed_at"]}
+    result, skipped = await _rebuild(db, None)
+    for _ in range(BACKFILL_ATTEMPTS):
+        if not skipped:
+            break
+        retry, skipped = await _rebuild(db, skipped)
+        result["rebuilt"] += retry["rebuilt"]
+    result["skipped"] = len(skipped)
+    if not skipped:
+        await db.ledger_state.update_one(
+            {"_id": BACKFILL_STATE_ID},
+            {"$set": {"completed_at": datetime.utcnow(), **result}},
+            upsert=True
+        )
+    logger.info(f"Ledger backfill: {result}")
+    return result
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from database import connect_to_mongo, close_mongo_connection
+
+    parser = argparse.ArgumentParser(description="Maintain JATES9 user ledgers")
+    parser.add_argument("command", choices=["reconcile"])
+    parser.parse_args()
+
+    async def main():
+        db = await connect_to_mongo()
+        try:
+            print(await rebuild_ledgers(db))
+        finally:
+            close_mongo_connection()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
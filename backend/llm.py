@@ -0,0 +1,346 @@
+"""LLM clients used by the chat router.
+
+`LLM_BACKEND` selects the implementation:
+
+    emergent  LlmChat from emergentintegrations (default). It has no
+              streaming API, so `stream` yields the full reply once. One
+              LlmChat is kept per chat session (LRU, LLM_SESSION_CACHE_SIZE)
+              instead of being built for every message, and it keeps that
+              session's conversation itself.
+    litellm   litellm.acompletion with token streaming, for providers
+              reachable directly (LLM_API_KEY / LLM_API_BASE). Stateless:
+              the chat routes pass the session's last LLM_HISTORY_MESSAGES
+              stored messages as `history`.
+    fake      canned local replies for development and tests.
+
+`LlmGateway` wraps the configured client for the whole process: it caps
+in-flight upstream calls, queues a bounded number of waiters with a
+deadline, and sheds the rest with `LlmOverloaded`. The queue wait and the
+upstream call share one LLM_REQUEST_TIMEOUT_SECONDS deadline.
+
+`ResponseCache` stores answers to first-turn questions so repeated FAQs
+("apa itu Jates9?", package prices, ...) skip the LLM entirely.
+"""
+from cache import CacheBackend, create_cache_backend
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "emergent")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-5")
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "60"))
+LLM_SESSION_CACHE_SIZE = int(os.getenv("LLM_SESSION_CACHE_SIZE", "1000"))
+LLM_HISTORY_MESSAGES = int(os.getenv("LLM_HISTORY_MESSAGES", "20"))
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+
+# Earlier turns of a session, oldest first: [{"role", "content"}, ...]
+History = Optional[List[dict]]
+
+class LlmClient:
+    """Interface: one reply for one user message within a session"""
+
+    async def complete(self, session_id: str, system_message: str, text: str, history: History = None) -> str:
+        raise NotImplementedError
+
+    async def stream(self, session_id: str, system_message: str, text: str,
+                     history: History = None) -> AsyncIterator[str]:
+        yield await self.complete(session_id, system_message, text, history)
+
+class EmergentLlmClient(LlmClient):
+    def __init__(self, api_key: Optional[str], provider: str = LLM_PROVIDER, model: str = LLM_MODEL,
+                 max_sessions: int = LLM_SESSION_CACHE_SIZE):
+        self.api_key = api_key
+        self.provider = provider
+        self.model = model
+        self.max_sessions = max_sessions
+        self._chats: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+
+    def _chat(self, session_id: str, system_message: str):
+        """The session's LlmChat, created on first use and kept LRU-bounded"""
+        key = (session_id, system_message)
+        chat = self._chats.get(key)
+        if chat is None:
+            from emergentintegrations.llm.chat import LlmChat
+            chat = self._chats[key] = LlmChat(
+                api_key=self.api_key,
+                session_id=session_id,
+                system_message=system_message
+            ).with_model(self.provider, self.model)
+            while len(self._chats) > self.max_sessions:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(key)
+        return chat
+
+    async def complete(self, session_id: str, system_message: str, text: str, history: History = None) -> str:
+        # LlmChat already holds the session's earlier turns
+        from emergentintegrations.llm.chat import UserMessage
+        return await self._chat(session_id, system_message).send_message(UserMessage(text=text))
+
+class LiteLlmClient(LlmClient):
+    def __init__(self, api_key: Optional[str], api_base: Optional[str] = None,
+                 provider: str = LLM_PROVIDER, model: str = LLM_MODEL):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.model = f"{provider}/{model}"
+
+    def _request(self, system_message: str, text: str, history: History, stream: bool) -> dict:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                *({"role": m["role"], "content": m["content"]} for m in history or []),
+                {"role": "user", "content": text}
+            ],
+            "api_key": self.api_key,
+            "api_base": self.api_base,
+            "stream": stream
+        }
+
+    async def complete(self, session_id: str, system_message: str, text: str, history: History = None) -> str:
+        import litellm
+        response = await litellm.acompletion(**self._request(system_message, text, history, stream=False))
+        return response.choices[0].message.content or ""
+
+    async def stream(self, session_id: str, system_message: str, text: str,
+                     history: History = None) -> AsyncIterator[str]:
+        import litellm
+        response = await litellm.acompletion(**self._request(system_message, text, history, stream=True))
+        try:
+            async for chunk in response:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            # Closing the upstream stream stops token generation on disconnect
+            close = getattr(response, "aclose", None)
+            if close:
+                await close()
+
+class FakeLlmClient(LlmClient):
+    """Deterministic local LLM: echoes the question word by word"""
+
+    def __init__(self, delay: float = 0.0, reply: Optional[str] = None):
+        self.delay = delay
+        self.reply = reply
+
+    def _reply(self, text: str) -> str:
+        return self.reply or f"Doktor AI (lokal): Anda bertanya \"{text}\"."
+
+    async def complete(self, session_id: str, system_message: str, text: str, history: History = None) -> str:
+        await asyncio.sleep(self.delay)
+        return self._reply(text)
+
+    async def stream(self, session_id: str, system_message: str, text: str,
+                     history: History = None) -> AsyncIterator[str]:
+        words = self._reply(text).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.delay)
+            yield word if i == 0 else " " + word
+
+class LlmOverloaded(Exception):
+    """Raised when the gateway queue is full or the queue wait expires"""
+
+class LlmGateway(LlmClient):
+    def __init__(
+        self,
+        client: LlmClient,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        request_timeout: float = LLM_REQUEST_TIMEOUT_SECONDS
+    ):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._waits = deque(maxlen=1024)
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    @property
+    def saturated(self) -> bool:
+        """True when a new request would be shed immediately"""
+        return self.queued >= self.max_queue and self._slots.locked()
+
+    async def _acquire(self, deadline: float):
+        if self.saturated:
+            self.shed += 1
+            raise LlmOverloaded("LLM queue is full")
+        started = time.perf_counter()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), min(self.queue_timeout, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise LlmOverloaded("Timed out waiting for an LLM slot")
+        finally:
+            self.queued -= 1
+        self._waits.append((time.perf_counter() - started) * 1000)
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _record(self, error: BaseException):
+        if isinstance(error, asyncio.TimeoutError):
+            self.timeouts += 1
+        elif not isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            self.errors += 1
+
+    async def complete(self, session_id: str, system_message: str, text: str, history: History = None) -> str:
+        # One deadline covers the queue wait and the upstream call
+        deadline = time.monotonic() + self.request_timeout
+        await self._acquire(deadline)
+        try:
+            answer = await asyncio.wait_for(
+                self.client.complete(session_id, system_message, text, history),
+                deadline - time.monotonic()
+            )
+            self.completed += 1
+            return answer
+        except BaseException as e:
+            self._record(e)
+            raise
+        finally:
+            self._release()
+
+    async def stream(self, session_id: str, system_message: str, text: str,
+                     history: History = None) -> AsyncIterator[str]:
+        deadline = time.monotonic() + self.request_timeout
+        await self._acquire(deadline)
+        upstream = self.client.stream(session_id, system_message, text, history)
+        try:
+            while True:
+                try:
+                    delta = await asyncio.wait_for(upstream.__anext__(), deadline - time.monotonic())
+                except StopAsyncIteration:
+                    break
+                yield delta
+            self.completed += 1
+        except BaseException as e:
+            self._record(e)
+            raise
+        finally:
+            await upstream.aclose()
+            self._release()
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(int(len(waits) * p), len(waits) - 1)], 3)
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "completed": self.completed,
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "queue_wait_ms": {
+                "samples": len(waits),
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "max": round(waits[-1], 3) if waits else 0.0
+            }
+        }
+
+def create_llm_client(backend: str = LLM_BACKEND) -> LlmClient:
+    if backend == "litellm":
+        return LiteLlmClient(os.getenv("LLM_API_KEY"), os.getenv("LLM_API_BASE"))
+    if backend == "fake":
+        return FakeLlmClient(delay=float(os.getenv("LLM_FAKE_DELAY", "0.05")))
+    return EmergentLlmClient(os.getenv("EMERGENT_LLM_KEY"))
+
+_llm_gateway: Optional[LlmGateway] = None
+
+def get_llm_gateway() -> LlmGateway:
+    global _llm_gateway
+    if _llm_gateway is None:
+        _llm_gateway = LlmGateway(create_llm_client())
+    return _llm_gateway
+
+def get_llm_client() -> LlmClient:
+    """Dependency returning the process-wide, concurrency-limited LLM client"""
+    return get_llm_gateway()
+
+def normalize_question(text: str) -> str:
+    """Lowercase, collapse whitespace and drop surrounding punctuation"""
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.strip(" ?!.,")
+
+class ResponseCache:
+    """Answer cache keyed on the normalized question and the prompt/model"""
+
+    def __init__(self, backend: Optional[CacheBackend], ttl: float = LLM_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(system_message: str, text: str) -> str:
+        prompt = hashlib.sha256(f"{LLM_PROVIDER}/{LLM_MODEL}\n{system_message}".encode()).hexdigest()[:16]
+        question = hashlib.sha256(normalize_question(text).encode()).hexdigest()
+        return f"llm:{prompt}:{question}"
+
+    async def get(self, system_message: str, text: str) -> Optional[str]:
+        if self.backend is None:
+            return None
+        answer = await self.backend.get(self.key(system_message, text))
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    async def set(self, system_message: str, text: str, answer: str):
+        if self.backend is not None and answer:
+            await self.backend.set(self.key(system_message, text), answer, self.ttl)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.backend) if hasattr(self.backend, "__len__") else None
+        }
+
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> ResponseCache:
+    """Dependency returning the process-wide LLM answer cache"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(create_cache_backend(LLM_CACHE_BACKEND, LLM_CACHE_MAX_ENTRIES))
+    return _response_cache
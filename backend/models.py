@@ -56,8 +56,7 @@ class Challenge(BaseModel):
     user_id: str
     current_day: int = 1
     start_date: datetime
-    completed_tasks: List[ChallengeTask] = []
-    streak_days: int = 0
+    day_tasks: List[int] = Field(default_factory=lambda: [0] * 30)  # bit per morning/noon/evening
     status: str = "active"
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -89,6 +88,7 @@ class ChatSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     session_id: str
-    messages: List[ChatMessage] = []
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
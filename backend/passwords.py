@@ -0,0 +1,84 @@
+"""Password hashing on a bounded thread pool.
+
+bcrypt holds the CPU for ~100-300 ms per call, so hashing and verification
+run on a dedicated executor instead of the event loop (bcrypt releases the
+GIL while it works). `BCRYPT_ROUNDS` sets the cost factor; hashes made with
+a different cost are upgraded on the next successful login.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from typing import Optional, Tuple
+import asyncio
+import os
+import threading
+import time
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+class HashingMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.ops = {
+            op: {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "queue_ms": 0.0}
+            for op in ("hash", "verify")
+        }
+
+    def record(self, op: str, queue_ms: float, work_ms: float):
+        with self._lock:
+            stats = self.ops[op]
+            stats["count"] += 1
+            stats["total_ms"] += work_ms
+            stats["queue_ms"] += queue_ms
+            stats["max_ms"] = max(stats["max_ms"], work_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ops = {
+                op: {
+                    "count": s["count"],
+                    "avg_ms": round(s["total_ms"] / s["count"], 3) if s["count"] else 0.0,
+                    "avg_queue_ms": round(s["queue_ms"] / s["count"], 3) if s["count"] else 0.0,
+                    "max_ms": round(s["max_ms"], 3),
+                    "total_ms": round(s["total_ms"], 3)
+                }
+                for op, s in self.ops.items()
+            }
+        return {
+            "rounds": BCRYPT_ROUNDS,
+            "workers": PASSWORD_HASH_WORKERS,
+            "queued": self.queued,
+            **ops
+        }
+
+metrics = HashingMetrics()
+
+async def _run(op: str, fn, *args):
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        result = fn(*args)
+        metrics.record(op, (started - submitted) * 1000, (time.perf_counter() - started) * 1000)
+        return result
+
+    metrics.queued += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, timed)
+    finally:
+        metrics.queued -= 1
+
+async def hash_password(password: str) -> str:
+    return await _run("hash", pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run("verify", pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify; also return a fresh hash when the stored one uses an old cost"""
+    return await _run("verify", pwd_context.verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,161 @@
+"""Weekly withdrawal payout runs.
+
+`create_payout_batch` selects pending withdrawal requests and, in one
+transaction, locks them into a `payout_batches` document: each request is
+marked paid with its `payout_batch_id`, and every balance decrement (the
+ledger reservation released into `commission_withdrawn`, plus the legacy
+`users` counters) is applied with one `bulk_write` per collection. A
+request can only be locked while it is still pending, so it is never
+paid in two batches.
+
+`payout_csv` streams the bank-transfer file for a batch; it can be
+downloaded again at any time.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from bson import ObjectId
+from database import run_transaction
+from security import invalidate_principal
+from dashboard_cache import dashboard_cache
+from ledger import ledger_update
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+import csv
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_PAYOUT_BATCH_SIZE = 1000
+CSV_CHUNK_SIZE = 500
+
+CSV_COLUMNS = [
+    "payout_batch_id", "withdrawal_id", "bank_name", "account_number",
+    "account_name", "amount", "user_name", "user_phone", "requested_at"
+]
+
+async def create_payout_batch(
+    db: AsyncIOMotorDatabase,
+    admin_id: str,
+    withdrawal_ids: Optional[List[str]] = None,
+    created_before: Optional[datetime] = None,
+    note: Optional[str] = None
+) -> Optional[dict]:
+    """Pay out pending requests (all, or the given ids); None when none are pending"""
+    selector: dict = {"status": "pending"}
+    if withdrawal_ids is not None:
+        selector["_id"] = {"$in": [ObjectId(w) for w in withdrawal_ids if ObjectId.is_valid(w)]}
+    if created_before is not None:
+        selector["created_at"] = {"$lte": created_before}
+
+    async def apply(session) -> Optional[dict]:
+        now = datetime.utcnow()
+        batch_id = ObjectId()
+        withdrawals = await db.withdrawal_requests.find(
+            selector, {"user_id": 1, "amount": 1}, session=session
+        ).sort("created_at", 1).limit(MAX_PAYOUT_BATCH_SIZE).to_list(length=None)
+        if not withdrawals:
+            return None
+
+        locked = await db.withdrawal_requests.update_many(
+            {"_id": {"$in": [w["_id"] for w in withdrawals]}, "status": "pending"},
+            {"$set": {
+                "status": "paid",
+                "payout_batch_id": batch_id,
+                "admin_note": note,
+                "processed_by": admin_id,
+                "processed_at": now
+            }},
+            session=session
+        )
+        if locked.modified_count != len(withdrawals):
+            # Only possible without a transaction (standalone server)
+            withdrawals = await db.withdrawal_requests.find(
+                {"payout_batch_id": batch_id}, {"user_id": 1, "amount": 1}, session=session
+            ).to_list(length=None)
+
+        totals: Dict[str, float] = defaultdict(float)
+        for w in withdrawals:
+            totals[w["user_id"]] += w["amount"]
+        await db.user_ledgers.bulk_write([
+            UpdateOne(
+                {"_id": user_id},
+                ledger_update({"withdrawal_pending": -amount, "commission_withdrawn": amount}, now),
+                upsert=True
+            )
+            for user_id, amount in totals.items()
+        ], ordered=True, session=session)
+        user_ops = [
+            UpdateOne(
+                {"_id": ObjectId(user_id)},
+                {"$inc": {"commission_pending": -amount, "commission_withdrawn": amount}}
+            )
+            for user_id, amount in totals.items() if ObjectId.is_valid(user_id)
+        ]
+        if user_ops:
+            await db.users.bulk_write(user_ops, ordered=True, session=session)
+
+        batch = {
+            "_id": batch_id,
+            "status": "paid",
+            "withdrawal_count": len(withdrawals),
+            "user_count": len(totals),
+            "total_amount": sum(totals.values()),
+            "note": note,
+            "created_by": admin_id,
+            "created_at": now
+        }
+        await db.payout_batches.insert_one(batch, session=session)
+        return {**batch, "user_ids": list(totals)}
+
+    batch = await run_transaction(apply)
+    if batch is None:
+        return None
+    user_ids = batch.pop("user_ids")
+    for user_id in user_ids:
+        await invalidate_principal(user_id)
+    await dashboard_cache.invalidate_many(user_ids, "overview")
+    logger.info(
+        f"Payout batch {batch['_id']} by {admin_id}: "
+        f"{batch['withdrawal_count']} withdrawals, total {batch['total_amount']}"
+    )
+    return batch
+
+def _cell(value) -> str:
+    """Stringify a CSV cell, neutralizing spreadsheet formulas"""
+    text = "" if value is None else str(value)
+    if text[:1] in ("=", "+", "-", "@", "\t", "\r"):
+        text = "'" + text
+    return text
+
+async def payout_csv(db: AsyncIOMotorDatabase, batch_id: ObjectId) -> AsyncIterator[str]:
+    """Bank-transfer rows for a batch, streamed in chunks of CSV_CHUNK_SIZE"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue()
+
+    cursor = db.withdrawal_requests.find(
+        {"payout_batch_id": batch_id},
+        {"user_id": 1, "amount": 1, "bank_name": 1, "account_number": 1, "account_name": 1, "created_at": 1}
+    ).sort("_id", 1).batch_size(CSV_CHUNK_SIZE)
+    while True:
+        chunk = await cursor.to_list(length=CSV_CHUNK_SIZE)
+        if not chunk:
+            break
+        user_ids = list({ObjectId(w["user_id"]) for w in chunk if ObjectId.is_valid(w["user_id"])})
+        users = {
+            str(u["_id"]): u
+            async for u in db.users.find({"_id": {"$in": user_ids}}, {"name": 1, "phone_number": 1})
+        }
+        buffer.seek(0)
+        buffer.truncate()
+        for w in chunk:
+            user = users.get(w["user_id"], {})
+            writer.writerow([_cell(v) for v in (
+                batch_id, w["_id"], w.get("bank_name"), w.get("account_number"), w.get("account_name"),
+                f"{w['amount']:.2f}", user.get("name"), user.get("phone_number"),
+                w["created_at"].isoformat() if w.get("created_at") else None
+            )])
+        yield buffer.getvalue()
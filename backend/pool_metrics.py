@@ -0,0 +1,116 @@
+from pymongo import monitoring
+from collections import deque
+from typing import Dict
+import threading
+import time
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Track per-server connection pool usage from pymongo CMAP events.
+
+    Checkouts happen on Motor's executor threads, so the check-out start time
+    is kept in a thread-local and all counters are guarded by a lock.
+    """
+
+    def __init__(self, sample_size: int = 1024):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._servers: Dict[str, dict] = {}
+        self._waits = deque(maxlen=sample_size)
+
+    def _server(self, address) -> dict:
+        key = f"{address[0]}:{address[1]}"
+        stats = self._servers.get(key)
+        if stats is None:
+            stats = {
+                "open": 0,
+                "checked_out": 0,
+                "created_total": 0,
+                "closed_total": 0,
+                "checkouts_total": 0,
+                "checkout_failures": 0,
+                "pool_cleared": 0
+            }
+            self._servers[key] = stats
+        return stats
+
+    # Pool events
+    def pool_created(self, event):
+        with self._lock:
+            self._server(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._server(event.address)["pool_cleared"] += 1
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._servers.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    # Connection events
+    def connection_created(self, event):
+        with self._lock:
+            stats = self._server(event.address)
+            stats["open"] += 1
+            stats["created_total"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            stats = self._server(event.address)
+            stats["open"] = max(stats["open"] - 1, 0)
+            stats["closed_total"] += 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        with self._lock:
+            self._server(event.address)["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        with self._lock:
+            stats = self._server(event.address)
+            stats["checked_out"] += 1
+            stats["checkouts_total"] += 1
+            if started is not None:
+                self._waits.append((time.perf_counter() - started) * 1000)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            stats = self._server(event.address)
+            stats["checked_out"] = max(stats["checked_out"] - 1, 0)
+
+    def snapshot(self) -> dict:
+        """Return current pool usage and recent check-out wait times (ms)"""
+        with self._lock:
+            servers = {
+                address: {**stats, "idle": max(stats["open"] - stats["checked_out"], 0)}
+                for address, stats in self._servers.items()
+            }
+            waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(int(len(waits) * p), len(waits) - 1)], 3)
+
+        return {
+            "servers": servers,
+            "checked_out": sum(s["checked_out"] for s in servers.values()),
+            "idle": sum(s["idle"] for s in servers.values()),
+            "wait_ms": {
+                "samples": len(waits),
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(waits[-1], 3) if waits else 0.0
+            }
+        }
@@ -0,0 +1,170 @@
+"""Purchase verification, one at a time or in batches.
+
+`verify_purchases` applies a list of admin decisions in one transaction:
+the purchases and their buyers are read in two queries, then status
+updates, commission inserts, referrer increments and ledger deltas are
+written as one ordered `bulk_write` per collection. Only purchases that
+are still pending inside the transaction are touched, so replaying a
+batch never pays a commission twice.
+
+Without transactions (standalone server) each status change is a separate
+conditional update, and commissions, referrer increments and ledger
+deltas are only written for the purchases this call actually moved out
+of `pending`; ones a concurrent verifier took are reported as
+`already_processed`.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import InsertOne, UpdateOne
+from bson import ObjectId
+from database import run_transaction
+from security import invalidate_principal
+from referrals import record_purchase
+from dashboard_cache import dashboard_cache
+from ledger import ledger_update
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMMISSION_RATE = 0.10
+MAX_BATCH_SIZE = 500
+
+def _ledger_ops(deltas: Dict[str, Dict[str, float]], now: datetime) -> List[UpdateOne]:
+    return [
+        UpdateOne({"_id": user_id}, ledger_update(inc, now), upsert=True)
+        for user_id, inc in deltas.items()
+    ]
+
+async def verify_purchases(db: AsyncIOMotorDatabase, admin_id: str, decisions: List[dict]) -> List[dict]:
+    """Apply `{"purchase_id", "approved"}` decisions; returns one result per item"""
+    results: List[dict] = []
+    wanted: Dict[str, bool] = {}
+    for item in decisions:
+        purchase_id = item["purchase_id"]
+        result = {"purchase_id": purchase_id}
+        if not ObjectId.is_valid(purchase_id):
+            result["result"] = "invalid_id"
+        elif purchase_id in wanted:
+            result["result"] = "duplicate"
+        else:
+            wanted[purchase_id] = item["approved"]
+        results.append(result)
+
+    async def apply(session):
+        now = datetime.utcnow()
+        outcome: Dict[str, dict] = {}
+        spent: Dict[str, float] = defaultdict(float)
+        purchases = await db.purchases.find(
+            {"_id": {"$in": [ObjectId(p) for p in wanted]}},
+            {"user_id": 1, "amount": 1, "status": 1},
+            session=session
+        ).to_list(length=None)
+        pending = []
+        for purchase in purchases:
+            purchase_id = str(purchase["_id"])
+            if purchase.get("status") != "pending":
+                outcome[purchase_id] = {"result": "already_processed", "status": purchase.get("status")}
+            else:
+                pending.append(purchase)
+
+        approved = [p for p in pending if wanted[str(p["_id"])]]
+        buyers = {
+            str(u["_id"]): u
+            for u in await db.users.find(
+                {"_id": {"$in": list({ObjectId(p["user_id"]) for p in approved if ObjectId.is_valid(p["user_id"])})}},
+                {"referred_by": 1},
+                session=session
+            ).to_list(length=None)
+        }
+
+        def status_update(purchase: dict) -> dict:
+            new_status = "verified" if wanted[str(purchase["_id"])] else "cancelled"
+            return {"$set": {"status": new_status, "verified_by": admin_id, "verified_at": now}}
+
+        if session is not None:
+            if pending:
+                await db.purchases.bulk_write([
+                    UpdateOne({"_id": p["_id"], "status": "pending"}, status_update(p)) for p in pending
+                ], ordered=True, session=session)
+            claimed = pending
+        else:
+            # A concurrent verifier may take some of these; only purchases
+            # moved by this call go on to pay commission
+            claimed = []
+            for purchase in pending:
+                moved = await db.purchases.update_one(
+                    {"_id": purchase["_id"], "status": "pending"}, status_update(purchase)
+                )
+                if moved.modified_count == 1:
+                    claimed.append(purchase)
+            claimed_ids = {p["_id"] for p in claimed}
+            lost = [p["_id"] for p in pending if p["_id"] not in claimed_ids]
+            if lost:
+                logger.warning(f"Purchase batch raced: {len(lost)} of {len(pending)} taken by another verifier")
+                async for purchase in db.purchases.find({"_id": {"$in": lost}}, {"status": 1}):
+                    outcome[str(purchase["_id"])] = {"result": "already_processed", "status": purchase.get("status")}
+
+        commission_ops = []
+        referrer_incs: Dict[str, float] = defaultdict(float)
+        ledger_deltas: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for purchase in claimed:
+            purchase_id = str(purchase["_id"])
+            new_status = status_update(purchase)["$set"]["status"]
+            outcome[purchase_id] = {"result": new_status, "commission": None}
+            if new_status != "verified":
+                continue
+            ledger_deltas[purchase["user_id"]]["total_spent"] += purchase["amount"]
+            spent[purchase["user_id"]] += purchase["amount"]
+            referrer_id = buyers.get(purchase["user_id"], {}).get("referred_by")
+            if referrer_id:
+                amount = purchase["amount"] * COMMISSION_RATE
+                commission_ops.append(InsertOne({
+                    "user_id": referrer_id,
+                    "from_user_id": purchase["user_id"],
+                    "purchase_id": purchase_id,
+                    "amount": amount,
+                    "status": "approved",
+                    "created_at": now
+                }))
+                referrer_incs[referrer_id] += amount
+                ledger_deltas[referrer_id]["commission_approved"] += amount
+                outcome[purchase_id]["commission"] = {"user_id": referrer_id, "amount": amount}
+
+        if commission_ops:
+            await db.commissions.bulk_write(commission_ops, ordered=True, session=session)
+        if any(ObjectId.is_valid(r) for r in referrer_incs):
+            await db.users.bulk_write([
+                UpdateOne(
+                    {"_id": ObjectId(referrer_id)},
+                    {"$inc": {"commission_pending": amount, "total_commission": amount}}
+                )
+                for referrer_id, amount in referrer_incs.items()
+                if ObjectId.is_valid(referrer_id)
+            ], ordered=True, session=session)
+        if ledger_deltas:
+            await db.user_ledgers.bulk_write(
+                _ledger_ops({u: dict(inc) for u, inc in ledger_deltas.items()}, now),
+                ordered=True,
+                session=session
+            )
+        return outcome, spent
+
+    outcome, spent = await run_transaction(apply) if wanted else ({}, {})
+
+    referrers = set()
+    for result in results:
+        if "result" not in result:
+            result.update(outcome.get(result["purchase_id"], {"result": "not_found"}))
+            if result.get("commission"):
+                referrers.add(result["commission"]["user_id"])
+
+    # Caches are refreshed after the commit
+    for referrer_id in referrers:
+        await invalidate_principal(referrer_id)
+    for buyer_id, amount in spent.items():
+        await record_purchase(db, buyer_id, amount)
+    await dashboard_cache.invalidate_many(referrers | set(spent), "overview")
+    logger.info(f"Purchase verification by {admin_id}: {len(outcome)} of {len(results)} items resolved")
+    return results
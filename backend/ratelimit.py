@@ -0,0 +1,291 @@
+"""Per-client rate limiting and load shedding middleware.
+
+Every request takes a token from each bucket its route defines:
+
+    ip      keyed by the client address (see RATE_LIMIT_PROXY_HOPS)
+    user    keyed by the `user_id` of a valid Bearer token, if any
+    phone   keyed by client address + the body's `phone_number`, so users
+            sharing a carrier-grade NAT address do not lock each other
+            out of login; the per-IP ceiling stays as a backstop
+    owner   keyed by the Bearer user, else the body's `user_id`: the chat
+            routes are called without a token and trust the session
+            owner named in the body, so that is what they are limited on
+
+Limits are (requests, seconds) token buckets per route prefix in
+ROUTE_LIMITS (longest matching prefix for the method wins, else
+DEFAULT_LIMITS); the bucket holds `requests` tokens and refills at
+requests/seconds. The bcrypt paths (login, register) and the LLM paths
+(chat message/stream) are the tightest. An empty bucket answers 429 with
+Retry-After set to when the next token arrives.
+
+Before that, requests are shed with 503 when the worker is overloaded:
+
+    in flight   LOAD_SHED_MAX_IN_FLIGHT requests are already being served
+    loop lag    event-loop lag (a sleep loop's overshoot, fast to rise and
+                slow to decay) is above LOAD_SHED_LAG_MS; the share shed
+                grows linearly from 0 at the threshold to 100% at twice it
+
+Request bodies are only read (and replayed to the route) for routes with
+phone or owner limits. Health checks are never limited and metrics are
+never shed. Buckets and counters are per process, so with N workers a
+client gets up to N times the configured rate.
+"""
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from security import decode_token
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import asyncio
+import math
+import orjson
+import os
+import random
+import time
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Reverse proxies in front of the app; the client is this many entries
+# from the end of X-Forwarded-For. 0 (the default) uses the socket peer;
+# set it only behind a proxy, or clients can pick their own address
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", "0"))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+LOAD_SHED_MAX_IN_FLIGHT = int(os.getenv("LOAD_SHED_MAX_IN_FLIGHT", "500"))
+LOAD_SHED_LAG_MS = float(os.getenv("LOAD_SHED_LAG_MS", "250"))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.getenv("LOAD_SHED_RETRY_AFTER_SECONDS", "2"))
+LAG_SAMPLE_INTERVAL_SECONDS = 0.1
+
+Limit = Tuple[int, float]
+
+DEFAULT_LIMITS: Dict[str, Limit] = {"ip": (600, 60), "user": (300, 60)}
+
+# (method, path prefix) -> limits; longest matching prefix wins
+ROUTE_LIMITS: Dict[Tuple[str, str], Dict[str, Limit]] = {
+    ("POST", "/api/auth/login"): {"ip": (120, 60), "phone": (10, 60)},
+    ("POST", "/api/auth/register"): {"ip": (60, 60), "phone": (5, 60)},
+    ("POST", "/api/quiz/submit"): {"ip": (20, 60)},
+    ("POST", "/api/chat/message"): {"ip": (60, 60), "owner": (10, 60)},
+    ("POST", "/api/chat/stream"): {"ip": (60, 60), "owner": (10, 60)},
+}
+
+BODY_KINDS = ("phone", "owner")
+
+UNLIMITED_PATHS = ("/api/health",)
+UNSHED_PATHS = ("/api/health", "/api/metrics")
+
+def limits_for(method: str, path: str) -> Tuple[str, Dict[str, Limit]]:
+    best = None
+    for route in ROUTE_LIMITS:
+        if route[0] == method and path.startswith(route[1]) and (best is None or len(route[1]) > len(best[1])):
+            best = route
+    if best is None:
+        return "default", DEFAULT_LIMITS
+    return f"{best[0]} {best[1]}", ROUTE_LIMITS[best]
+
+def client_ip(scope: Scope, headers: Headers, hops: int = RATE_LIMIT_PROXY_HOPS) -> str:
+    if hops > 0:
+        forwarded = [h.strip() for h in headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if forwarded:
+            return forwarded[-min(hops, len(forwarded))]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+async def read_body(receive: Receive) -> Tuple[bytes, Receive]:
+    """Buffer the request body and return a receive that replays it"""
+    messages = []
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request" or not message.get("more_body", False):
+            break
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.request")
+
+    async def replay() -> Message:
+        return messages.pop(0) if messages else await receive()
+    return body, replay
+
+def body_field(body: bytes, field: str) -> Optional[str]:
+    try:
+        value = orjson.loads(body).get(field)
+    except (orjson.JSONDecodeError, AttributeError):
+        return None
+    return str(value) if value else None
+
+async def token_user(headers: Headers) -> Optional[str]:
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return (await decode_token(token.strip()))["user_id"]
+    except Exception:
+        # Invalid tokens are rejected by the route itself
+        return None
+
+class TokenBuckets:
+    """LRU-bounded map of token buckets: key -> [tokens, updated_at]"""
+
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key: str, limit: Limit, now: Optional[float] = None) -> float:
+        """Take one token; 0 when allowed, else seconds until one is available"""
+        now = time.monotonic() if now is None else now
+        capacity, period = limit
+        rate = capacity / period
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(capacity), now]
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(capacity), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+class LoopLagMonitor:
+    """Event-loop lag sampled by a sleep loop, started on first use per loop"""
+
+    def __init__(self, interval: float = LAG_SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            self.lag = lag if lag > self.lag else self.lag * 0.8 + lag * 0.2
+
+class RateLimitStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.allowed = 0
+        self.limited: Dict[str, int] = {}
+        self.shed: Dict[str, int] = {"in_flight": 0, "loop_lag": 0}
+
+    def record_limited(self, route: str, kind: str):
+        key = f"{route} [{kind}]"
+        self.limited[key] = self.limited.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "allowed": self.allowed,
+            "limited": dict(self.limited),
+            "shed": dict(self.shed),
+            "in_flight": self.in_flight,
+            "max_in_flight": LOAD_SHED_MAX_IN_FLIGHT,
+            "loop_lag_ms": round(lag_monitor.lag * 1000, 2),
+            "max_loop_lag_ms": round(lag_monitor.max_lag * 1000, 2),
+            "lag_threshold_ms": LOAD_SHED_LAG_MS,
+            "buckets": len(buckets)
+        }
+
+buckets = TokenBuckets()
+lag_monitor = LoopLagMonitor()
+stats = RateLimitStats()
+
+class RateLimitMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        enabled: bool = RATE_LIMIT_ENABLED,
+        max_in_flight: int = LOAD_SHED_MAX_IN_FLIGHT,
+        lag_threshold: float = LOAD_SHED_LAG_MS / 1000
+    ):
+        self.app = app
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.lag_threshold = lag_threshold
+
+    def _shed_reason(self, path: str) -> Optional[str]:
+        if path.startswith(UNSHED_PATHS):
+            return None
+        if self.max_in_flight > 0 and stats.in_flight >= self.max_in_flight:
+            return "in_flight"
+        lag = lag_monitor.lag
+        if self.lag_threshold > 0 and lag > self.lag_threshold:
+            if random.random() < (lag - self.lag_threshold) / self.lag_threshold:
+                return "loop_lag"
+        return None
+
+    async def _retry_after(
+        self, scope: Scope, receive: Receive, headers: Headers, path: str
+    ) -> Tuple[float, str, str, Receive]:
+        """Seconds to wait (0 when allowed), the route and bucket kind, and the receive to pass on"""
+        route, limits = limits_for(scope["method"], path)
+        ip = client_ip(scope, headers)
+        identities = {"ip": ip}
+        if "user" in limits or "owner" in limits:
+            user_id = await token_user(headers)
+            if user_id:
+                identities["user"] = identities["owner"] = user_id
+        if any(kind in limits and kind not in identities for kind in BODY_KINDS):
+            body, receive = await read_body(receive)
+            phone = body_field(body, "phone_number")
+            if phone:
+                identities["phone"] = f"{ip}|{phone}"
+            owner = identities.get("owner") or body_field(body, "user_id")
+            if owner:
+                identities["owner"] = owner
+        for kind, identity in identities.items():
+            if kind in limits:
+                wait = buckets.take(f"{kind}:{route}:{identity}", limits[kind])
+                if wait:
+                    return wait, route, kind, receive
+        return 0.0, route, "", receive
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.enabled or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        lag_monitor.ensure_running()
+        path = scope["path"]
+
+        reason = self._shed_reason(path)
+        if reason is not None:
+            stats.shed[reason] += 1
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)}
+            )
+            await response(scope, receive, send)
+            return
+
+        if not path.startswith(UNLIMITED_PATHS):
+            headers = Headers(scope=scope)
+            wait, route, kind, receive = await self._retry_after(scope, receive, headers, path)
+            if wait:
+                stats.record_limited(route, kind)
+                response = JSONResponse(
+                    {"detail": "Too many requests, please retry later"},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, math.ceil(wait)))}
+                )
+                await response(scope, receive, send)
+                return
+        stats.allowed += 1
+
+        stats.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stats.in_flight -= 1
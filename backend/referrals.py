@@ -0,0 +1,187 @@
+"""Multi-level referral tree analytics.
+
+`users.referred_by` holds the referrer's id as a string. `$graphLookup`
+cannot convert `_id` while it walks, so each user also carries
+`user_id`, a string copy of `_id`. `register` sets it; users created
+before this field existed are backfilled, and downlines cached over the
+incomplete tree recomputed, once after deploy by the `referral-backfill`
+job (see server.py), or by hand with:
+
+    python referrals.py backfill
+    python referrals.py rebuild
+
+`compute_downline` walks the tree down from a user in one aggregation
+(indexed on `referred_by`) and joins `user_ledgers` for purchase volume.
+The result is cached per user in `referral_downlines`, and the cache is
+kept current incrementally: `record_referral` and `record_purchase` walk
+up from the new member or buyer (indexed on `user_id`) and `$inc` the
+right level of every cached ancestor. Ancestors with no cached document
+are skipped; they are computed in full on their first read.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from bson import ObjectId
+from datetime import datetime
+from typing import List
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+REFERRAL_MAX_DEPTH = int(os.getenv("REFERRAL_MAX_DEPTH", "10"))
+BACKFILL_STATE_ID = "user_ids"
+
+def _levels_list(levels: dict) -> List[dict]:
+    return [
+        {"level": int(level), "members": stats.get("members", 0), "purchase_volume": stats.get("purchase_volume", 0.0)}
+        for level, stats in sorted(levels.items(), key=lambda item: int(item[0]))
+    ]
+
+def _summary(user_id: str, cached: dict) -> dict:
+    levels = _levels_list(cached.get("levels", {}))
+    return {
+        "user_id": user_id,
+        "downline_size": sum(level["members"] for level in levels),
+        "depth": max((level["level"] for level in levels if level["members"]), default=0),
+        "purchase_volume": sum(level["purchase_volume"] for level in levels),
+        "levels": levels,
+        "max_depth": REFERRAL_MAX_DEPTH,
+        "computed_at": cached.get("computed_at"),
+        "updated_at": cached.get("updated_at")
+    }
+
+async def compute_downline(db: AsyncIOMotorDatabase, user_id: str, max_depth: int = REFERRAL_MAX_DEPTH) -> dict:
+    """Members and purchase volume per level below `user_id`, server-side"""
+    if not ObjectId.is_valid(user_id):
+        return {}
+    rows = await db.users.aggregate([
+        {"$match": {"_id": ObjectId(user_id)}},
+        {"$graphLookup": {
+            "from": "users",
+            "startWith": user_id,
+            "connectFromField": "user_id",
+            "connectToField": "referred_by",
+            "as": "downline",
+            "maxDepth": max_depth - 1,
+            "depthField": "depth"
+        }},
+        # $unwind must follow $graphLookup directly so the server coalesces
+        # the two and never builds the whole downline as one array
+        {"$unwind": "$downline"},
+        {"$project": {"_id": 0, "user_id": "$downline.user_id", "depth": "$downline.depth"}},
+        {"$lookup": {"from": "user_ledgers", "localField": "user_id", "foreignField": "_id", "as": "ledger"}},
+        {"$group": {
+            "_id": {"$add": ["$depth", 1]},
+            "members": {"$sum": 1},
+            "purchase_volume": {"$sum": {"$sum": "$ledger.total_spent"}}
+        }}
+    ], allowDiskUse=True).to_list(length=None)
+    return {
+        str(row["_id"]): {"members": row["members"], "purchase_volume": float(row["purchase_volume"])}
+        for row in rows
+    }
+
+async def get_downline(db: AsyncIOMotorDatabase, user_id: str, refresh: bool = False) -> dict:
+    """Cached downline summary; computed with $graphLookup on a miss or `refresh`"""
+    cached = None if refresh else await db.referral_downlines.find_one({"_id": user_id})
+    if cached is None:
+        now = datetime.utcnow()
+        cached = {"levels": await compute_downline(db, user_id), "computed_at": now, "updated_at": now}
+        await db.referral_downlines.replace_one({"_id": user_id}, cached, upsert=True)
+    return _summary(user_id, cached)
+
+async def _ancestors(db: AsyncIOMotorDatabase, user_id: str) -> List[dict]:
+    """Referrers above `user_id` with their level (1 = direct referrer)"""
+    if not ObjectId.is_valid(user_id):
+        return []
+    rows = await db.users.aggregate([
+        {"$match": {"_id": ObjectId(user_id)}},
+        {"$graphLookup": {
+            "from": "users",
+            "startWith": "$referred_by",
+            "connectFromField": "referred_by",
+            "connectToField": "user_id",
+            "as": "chain",
+            "maxDepth": REFERRAL_MAX_DEPTH - 1,
+            "depthField": "depth"
+        }},
+        {"$unwind": "$chain"},
+        {"$project": {"_id": 0, "user_id": "$chain.user_id", "level": {"$add": ["$chain.depth", 1]}}}
+    ]).to_list(length=None)
+    return rows
+
+async def _apply_to_ancestors(db: AsyncIOMotorDatabase, user_id: str, members: int, purchase_volume: float):
+    ancestors = await _ancestors(db, user_id)
+    if not ancestors:
+        return
+    now = datetime.utcnow()
+    ops = []
+    for ancestor in ancestors:
+        inc = {}
+        if members:
+            inc[f"levels.{ancestor['level']}.members"] = members
+        if purchase_volume:
+            inc[f"levels.{ancestor['level']}.purchase_volume"] = purchase_volume
+        ops.append(UpdateOne({"_id": ancestor["user_id"]}, {"$inc": inc, "$set": {"updated_at": now}}))
+    await db.referral_downlines.bulk_write(ops, ordered=False)
+
+async def record_referral(db: AsyncIOMotorDatabase, user_id: str):
+    """A new user joined below their referrer chain"""
+    await _apply_to_ancestors(db, user_id, members=1, purchase_volume=0.0)
+
+async def record_purchase(db: AsyncIOMotorDatabase, user_id: str, amount: float):
+    """A purchase by `user_id` was verified"""
+    await _apply_to_ancestors(db, user_id, members=0, purchase_volume=amount)
+
+async def backfill_user_ids(db: AsyncIOMotorDatabase) -> int:
+    """Copy `_id` into the string `user_id` field the graph walks use"""
+    result = await db.users.update_many(
+        {"user_id": {"$exists": False}},
+        [{"$set": {"user_id": {"$toString": "$_id"}}}]
+    )
+    return result.modified_count
+
+async def rebuild_downlines(db: AsyncIOMotorDatabase) -> dict:
+    """Recompute every cached downline, e.g. after deleting users"""
+    backfilled = await backfill_user_ids(db)
+    rebuilt = 0
+    async for cached in db.referral_downlines.find({}, {"_id": 1}):
+        await get_downline(db, cached["_id"], refresh=True)
+        rebuilt += 1
+    logger.info(f"Backfilled {backfilled} user ids, rebuilt {rebuilt} downlines")
+    return {"backfilled": backfilled, "rebuilt": rebuilt}
+
+async def backfill_referrals(db: AsyncIOMotorDatabase) -> dict:
+    """Backfill `user_id` and rebuild cached downlines once after deploy; later runs are a single lookup"""
+    state = await db.referral_state.find_one({"_id": BACKFILL_STATE_ID})
+    if state:
+        return {"completed_at": state["completed_at"]}
+    result = await rebuild_downlines(db)
+    await db.referral_state.update_one(
+        {"_id": BACKFILL_STATE_ID},
+        {"$set": {"completed_at": datetime.utcnow(), **result}},
+        upsert=True
+    )
+    return result
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from database import connect_to_mongo, close_mongo_connection
+
+    parser = argparse.ArgumentParser(description="Maintain JATES9 referral downlines")
+    parser.add_argument("command", choices=["backfill", "rebuild"])
+    args = parser.parse_args()
+
+    async def main():
+        db = await connect_to_mongo()
+        try:
+            if args.command == "backfill":
+                print(await backfill_user_ids(db))
+            else:
+                print(await rebuild_downlines(db))
+        finally:
+            close_mongo_connection()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
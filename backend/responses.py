@@ -0,0 +1,38 @@
+"""orjson response class used app-wide (see server.py).
+
+`OrjsonResponse` serializes datetimes natively and ObjectIds as their hex
+string. It is the app's `default_response_class`, so every route renders
+with orjson.
+
+Returning a plain dict still runs FastAPI's `jsonable_encoder` pass (and
+response_model validation when one is declared) before rendering. Hot
+endpoints with large payloads return `OrjsonResponse(...)` directly,
+which skips both steps. Measure the difference with:
+
+    python bench_serialization.py
+"""
+from fastapi.responses import JSONResponse
+from bson import ObjectId
+from decimal import Decimal
+from typing import Any
+import orjson
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+class OrjsonResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -2,36 +2,19 @@ from fastapi import APIRouter, HTTPException, Depends, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from auth_models import User, LoginRequest, RegisterRequest, UserRole
 from database import get_database
-from passlib.context import CryptContext
+from security import create_access_token, get_current_principal
+from ledger import apply_ledger_delta
+from passwords import hash_password, verify_and_update
+from referrals import record_referral
+from dashboard_cache import dashboard_cache
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import logging
-from datetime import datetime, timedelta
-import jwt
-import os
+from datetime import datetime
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_DAYS = 30
-
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
 @router.post("/register")
 async def register(
     request: RegisterRequest,
@@ -58,12 +41,15 @@ async def register(
                     detail="Invalid referral code"
                 )
         
-        # Create new user
+        # Create new user; `user_id` mirrors `_id` for referral tree lookups
+        user_oid = ObjectId()
         user_data = {
+            "_id": user_oid,
+            "user_id": str(user_oid),
             "name": request.name,
             "phone_number": request.phone_number,
             "email": request.email,
-            "password_hash": hash_password(request.password),
+            "password_hash": await hash_password(request.password),
             "role": UserRole.USER.value,
             "referred_by": str(referrer["_id"]) if referrer else None,
             "challenge_enrolled": False,
@@ -78,7 +64,14 @@ async def register(
             "updated_at": datetime.utcnow()
         }
         
-        result = await db.users.insert_one(user_data)
+        try:
+            result = await db.users.insert_one(user_data)
+        except DuplicateKeyError:
+            # A concurrent registration won the unique phone_number index
+            raise HTTPException(
+                status_code=400,
+                detail="Phone number already registered"
+            )
         user_id = str(result.inserted_id)
         
         # Update referrer's total referrals
@@ -87,6 +80,9 @@ async def register(
                 {"_id": referrer["_id"]},
                 {"$inc": {"total_referrals": 1}}
             )
+            await apply_ledger_delta(db, str(referrer["_id"]), referral_count=1)
+            await record_referral(db, user_id)
+            await dashboard_cache.invalidate(str(referrer["_id"]), "overview")
         
         # Create access token
         access_token = create_access_token({
@@ -125,11 +121,18 @@ async def login(
         
         # Verify password if provided (for backward compatibility with old users)
         if request.password and user.get("password_hash"):
-            if not verify_password(request.password, user["password_hash"]):
+            valid, new_hash = await verify_and_update(request.password, user["password_hash"])
+            if not valid:
                 raise HTTPException(
                     status_code=401,
                     detail="Invalid phone number or password"
                 )
+            # Stored hash used an older cost factor; upgrade it
+            if new_hash:
+                await db.users.update_one(
+                    {"_id": user["_id"], "password_hash": user["password_hash"]},
+                    {"$set": {"password_hash": new_hash}}
+                )
         
         # Check if user is active
         if not user.get("is_active", True):
@@ -159,39 +162,15 @@ async def login(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/me")
-async def get_current_user(
-    token: str,
-    db: AsyncIOMotorDatabase = Depends(get_database)
-):
+async def get_current_user(user: dict = Depends(get_current_principal)):
     """Get current user info from token"""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id")
-        
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        from bson import ObjectId
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        return {
-            "user_id": str(user["_id"]),
-            "name": user["name"],
-            "phone_number": user["phone_number"],
-            "email": user.get("email"),
-            "role": user.get("role", UserRole.USER.value),
-            "referral_code": user.get("referral_code"),
-            "total_commission": user.get("total_commission", 0.0),
-            "commission_pending": user.get("commission_pending", 0.0)
-        }
-        
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        logger.error(f"Error getting current user: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    return {
+        "user_id": user["user_id"],
+        "name": user["name"],
+        "phone_number": user["phone_number"],
+        "email": user.get("email"),
+        "role": user.get("role", UserRole.USER.value),
+        "referral_code": user.get("referral_code"),
+        "total_commission": user.get("total_commission", 0.0),
+        "commission_pending": user.get("commission_pending", 0.0)
+    }
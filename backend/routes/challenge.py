@@ -1,7 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import ChallengeEnrollment, CheckIn, Challenge, ChallengeTask
-from database import get_database
+from database import get_database, upsert_one
+from challenge_state import (
+    TIMES, TOTAL_DAYS, TOTAL_TASKS, empty_day_tasks, task_mask, day_tasks_of,
+    completed_count, streak_days, next_task, migrate_challenge, current_day_for
+)
+from etags import weak_etag, etag_matches, not_modified, tagged
+from versions import bump_version
+from dashboard_cache import dashboard_cache
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
 import logging
 
@@ -15,55 +23,47 @@ async def enroll_challenge(
 ):
     """Enroll user in 30 Day Challenge"""
     try:
-        # Find or create user
-        user = await db.users.find_one({"phone_number": enrollment.phone_number})
-        
-        if not user:
-            # Create new user
-            user_data = {
-                "phone_number": enrollment.phone_number,
-                "name": enrollment.name,
-                "health_type": enrollment.health_type,
-                "challenge_enrolled": True,
-                "challenge_start_date": enrollment.start_date,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            result = await db.users.insert_one(user_data)
-            user_id = str(result.inserted_id)
-        else:
-            user_id = str(user["_id"])
-            # Update user enrollment status
-            await db.users.update_one(
-                {"_id": user["_id"]},
-                {
-                    "$set": {
-                        "challenge_enrolled": True,
-                        "challenge_start_date": enrollment.start_date,
-                        "updated_at": datetime.utcnow()
-                    }
+        now = datetime.utcnow()
+        
+        # Find or create user in one round trip (unique phone_number)
+        user = await upsert_one(
+            db.users,
+            {"phone_number": enrollment.phone_number},
+            {
+                "$set": {
+                    "challenge_enrolled": True,
+                    "challenge_start_date": enrollment.start_date,
+                    "updated_at": now
+                },
+                "$setOnInsert": {
+                    "name": enrollment.name,
+                    "health_type": enrollment.health_type,
+                    "created_at": now
                 }
-            )
-        
-        # Check if challenge already exists
-        existing_challenge = await db.challenges.find_one({"user_id": user_id, "status": "active"})
-        
-        if existing_challenge:
-            challenge_id = str(existing_challenge["_id"])
-        else:
-            # Create new challenge
-            challenge_data = {
-                "user_id": user_id,
-                "current_day": 1,
-                "start_date": enrollment.start_date,
-                "completed_tasks": [],
-                "streak_days": 0,
-                "status": "active",
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            result = await db.challenges.insert_one(challenge_data)
-            challenge_id = str(result.inserted_id)
+            },
+            projection={"_id": 1}
+        )
+        user_id = str(user["_id"])
+        
+        # Reuse the active challenge or create it; the partial unique index
+        # on active challenges keeps this to one per user
+        challenge = await upsert_one(
+            db.challenges,
+            {"user_id": user_id, "status": "active"},
+            {
+                "$setOnInsert": {
+                    "current_day": 1,
+                    "start_date": enrollment.start_date,
+                    "day_tasks": empty_day_tasks(),
+                    "created_at": now,
+                    "updated_at": now
+                }
+            },
+            projection={"_id": 1, "start_date": 1}
+        )
+        challenge_id = str(challenge["_id"])
+        await bump_version(db, user_id, "challenge", challenge_start=challenge["start_date"])
+        await dashboard_cache.invalidate(user_id, "overview")
         
         return {
             "success": True,
@@ -81,53 +81,37 @@ async def enroll_challenge(
 @router.get("/progress/{user_id}", response_model=dict)
 async def get_progress(
     user_id: str,
+    request: Request,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """Get user's challenge progress"""
+    """Get user's challenge progress (read-only)"""
     try:
-        challenge = await db.challenges.find_one({"user_id": user_id, "status": "active"})
+        # Active challenge ("active" sorts first), else the latest completed one
+        challenge = await db.challenges.find_one(
+            {"user_id": user_id, "status": {"$in": ["active", "completed"]}},
+            {"status": 1, "start_date": 1, "updated_at": 1, "day_tasks": 1, "completed_tasks": 1},
+            sort=[("status", 1), ("start_date", -1)]
+        )
         
         if not challenge:
             raise HTTPException(status_code=404, detail="Active challenge not found")
         
-        # Calculate current day based on start date
-        start_date = challenge["start_date"]
-        days_passed = (datetime.utcnow() - start_date).days + 1
-        current_day = min(days_passed, 30)
-        
-        # Update current day
-        await db.challenges.update_one(
-            {"_id": challenge["_id"]},
-            {"$set": {"current_day": current_day, "updated_at": datetime.utcnow()}}
-        )
-        
-        completed_tasks = challenge.get("completed_tasks", [])
-        total_tasks = 90  # 30 days * 3 tasks per day
-        
-        # Determine next task
-        times = ["morning", "noon", "evening"]
-        next_task = None
-        for time in times:
-            task_exists = any(
-                t["day"] == current_day and t["time"] == time
-                for t in completed_tasks
-            )
-            if not task_exists:
-                next_task = {
-                    "day": current_day,
-                    "time": time,
-                    "task": f"Tugas {time} hari ke-{current_day}",
-                    "completed": False
-                }
-                break
+        # Current day is derived from the start date; nothing is written.
+        # Every task write bumps updated_at, so it versions the rest
+        current_day = current_day_for(challenge["start_date"])
+        etag = weak_etag("progress", user_id, challenge["_id"], challenge["status"], challenge.get("updated_at"), current_day)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        day_tasks = day_tasks_of(challenge)
         
-        return {
+        return tagged({
+            "status": challenge["status"],
             "current_day": current_day,
-            "completed_tasks": len(completed_tasks),
-            "total_tasks": total_tasks,
-            "streak_days": challenge.get("streak_days", 0),
-            "next_task": next_task
-        }
+            "completed_tasks": completed_count(day_tasks),
+            "total_tasks": TOTAL_TASKS,
+            "streak_days": streak_days(day_tasks),
+            "next_task": next_task(day_tasks, current_day)
+        }, etag)
         
     except HTTPException:
         raise
@@ -142,61 +126,52 @@ async def check_in(
 ):
     """Check-in for daily task completion"""
     try:
-        challenge = await db.challenges.find_one({"user_id": checkin.user_id, "status": "active"})
-        
-        if not challenge:
-            raise HTTPException(status_code=404, detail="Active challenge not found")
+        if checkin.day < 1 or checkin.day > TOTAL_DAYS or checkin.time not in TIMES:
+            raise HTTPException(status_code=400, detail="Invalid day or time")
         
         if checkin.task_completed:
-            # Add completed task
-            task = {
-                "day": checkin.day,
-                "time": checkin.time,
-                "task": checkin.notes or f"Tugas {checkin.time} hari ke-{checkin.day}",
-                "completed_at": datetime.utcnow()
+            # Setting the task bit is atomic and idempotent
+            query = {"user_id": checkin.user_id, "status": "active", "day_tasks": {"$type": "array"}}
+            update = {
+                "$bit": {f"day_tasks.{checkin.day - 1}": {"or": task_mask(checkin.time)}},
+                "$set": {"updated_at": datetime.utcnow()}
             }
-            
-            # Update challenge
-            completed_tasks = challenge.get("completed_tasks", [])
-            completed_tasks.append(task)
-            
-            # Calculate streak
-            last_check_in_day = max([t["day"] for t in completed_tasks]) if completed_tasks else 0
-            current_streak = challenge.get("streak_days", 0)
-            
-            if checkin.day == last_check_in_day or checkin.day == last_check_in_day + 1:
-                new_streak = checkin.day
-            else:
-                new_streak = current_streak
-            
-            await db.challenges.update_one(
-                {"_id": challenge["_id"]},
-                {
-                    "$set": {
-                        "completed_tasks": completed_tasks,
-                        "streak_days": new_streak,
-                        "updated_at": datetime.utcnow()
-                    }
-                }
+            challenge = await db.challenges.find_one_and_update(
+                query, update, projection={"day_tasks": 1}, return_document=ReturnDocument.AFTER
             )
             
+            if not challenge:
+                # Either no active challenge or one still in the legacy layout
+                legacy = await db.challenges.find_one(
+                    {"user_id": checkin.user_id, "status": "active"},
+                    {"completed_tasks": 1, "day_tasks": 1}
+                )
+                if not legacy:
+                    raise HTTPException(status_code=404, detail="Active challenge not found")
+                await migrate_challenge(db, legacy)
+                challenge = await db.challenges.find_one_and_update(
+                    query, update, projection={"day_tasks": 1}, return_document=ReturnDocument.AFTER
+                )
+                if not challenge:
+                    # Completed or cancelled since the lookup above
+                    raise HTTPException(status_code=404, detail="Active challenge not found")
+            
             # Determine next task
-            times = ["morning", "noon", "evening"]
-            current_time_idx = times.index(checkin.time)
+            current_time_idx = TIMES.index(checkin.time)
             
-            if current_time_idx < len(times) - 1:
-                next_time = times[current_time_idx + 1]
+            if current_time_idx < len(TIMES) - 1:
+                next_time = TIMES[current_time_idx + 1]
                 next_day = checkin.day
             else:
                 next_time = "morning"
                 next_day = checkin.day + 1
             
-            next_task = f"Tugas {next_time} hari ke-{next_day}"
+            next_task_label = f"Tugas {next_time} hari ke-{next_day}"
             
             return {
                 "success": True,
-                "streak_days": new_streak,
-                "next_task": next_task
+                "streak_days": streak_days(challenge["day_tasks"]),
+                "next_task": next_task_label
             }
         
         return {
@@ -1,18 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import ChatRequest, ChatResponse, ChatMessage
 from database import get_database
-from emergentintegrations.llm.chat import LlmChat, UserMessage
-import os
+from chat_store import append_messages, get_messages, latest_session_id, is_first_turn
+from responses import OrjsonResponse, dumps
+from llm import LLM_HISTORY_MESSAGES, LlmClient, ResponseCache, get_llm_client, get_response_cache
+import asyncio
 import logging
 from datetime import datetime
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-# Initialize AI Chat
-EMERGENT_LLM_KEY = os.getenv("EMERGENT_LLM_KEY")
-
 # System message untuk Doktor AI
 SYSTEM_MESSAGE = """Anda adalah Doktor AI, asisten kesehatan virtual untuk JATES9 Ecosystem. 
 Anda adalah expert dalam kesehatan pencernaan dan membantu user dengan masalah maag, kembung, dan sembelit.
@@ -38,75 +39,48 @@ Program 30 Hari Challenge:
 Jawab dengan singkat, jelas, dan actionable. Maksimal 3-4 paragraf.
 """
 
+STREAM_RETRY_AFTER_SECONDS = 5
+
+FALLBACK_RESPONSE = "Maaf, saya sedang mengalami gangguan. Silakan coba lagi dalam beberapa saat. Untuk bantuan langsung, Anda bisa menghubungi tim kami via WhatsApp."
+
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     request: ChatRequest,
-    db: AsyncIOMotorDatabase = Depends(get_database)
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    llm: LlmClient = Depends(get_llm_client),
+    cache: ResponseCache = Depends(get_response_cache)
 ):
     """Send message to AI and get response"""
     try:
-        # Get or create chat session
-        session = await db.chat_sessions.find_one({
-            "user_id": request.user_id,
-            "session_id": request.session_id
-        })
-        
-        if not session:
-            # Create new session
-            session_data = {
-                "user_id": request.user_id,
-                "session_id": request.session_id,
-                "messages": [],
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            await db.chat_sessions.insert_one(session_data)
-            messages_history = []
-        else:
-            messages_history = session.get("messages", [])
-        
-        # Add user message to history
         user_message_data = {
             "role": "user",
             "content": request.message,
             "timestamp": datetime.utcnow()
         }
-        messages_history.append(user_message_data)
         
-        # Initialize LLM Chat with proper configuration
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=request.session_id,
-            system_message=SYSTEM_MESSAGE
-        ).with_model("openai", "gpt-5")  # Use gpt-5 instead of gpt-5.1
-        
-        # Create user message
-        user_msg = UserMessage(text=request.message)
+        # First-turn questions are answered from the cache when possible
+        first_turn = await is_first_turn(db, request.user_id, request.session_id)
+        ai_response = await cache.get(SYSTEM_MESSAGE, request.message) if first_turn else None
         
         # Get AI response
-        ai_response = await chat.send_message(user_msg)
+        if ai_response is None:
+            history = await recent_history(db, request.user_id, request.session_id, first_turn)
+            ai_response = await llm.complete(request.session_id, SYSTEM_MESSAGE, request.message, history)
+            if first_turn:
+                await cache.set(SYSTEM_MESSAGE, request.message, ai_response)
         
-        # Add AI response to history
         ai_message_data = {
             "role": "assistant",
             "content": ai_response,
             "timestamp": datetime.utcnow()
         }
-        messages_history.append(ai_message_data)
         
-        # Update session in database
-        await db.chat_sessions.update_one(
-            {
-                "user_id": request.user_id,
-                "session_id": request.session_id
-            },
-            {
-                "$set": {
-                    "messages": messages_history,
-                    "updated_at": datetime.utcnow()
-                }
-            },
-            upsert=True
+        # Append both turns; the session document only holds counters
+        await append_messages(
+            db,
+            request.user_id,
+            request.session_id,
+            [user_message_data, ai_message_data]
         )
         
         return ChatResponse(
@@ -118,41 +92,135 @@ async def send_message(
     except Exception as e:
         logger.error(f"Error in AI chat: {e}")
         # Fallback response
-        fallback_response = "Maaf, saya sedang mengalami gangguan. Silakan coba lagi dalam beberapa saat. Untuk bantuan langsung, Anda bisa menghubungi tim kami via WhatsApp."
         return ChatResponse(
             success=False,
-            response=fallback_response,
+            response=FALLBACK_RESPONSE,
             session_id=request.session_id
         )
 
+async def recent_history(db: AsyncIOMotorDatabase, user_id: str, session_id: str, first_turn: bool) -> list:
+    """The session's last stored messages, for clients that keep no conversation state"""
+    if first_turn or LLM_HISTORY_MESSAGES <= 0:
+        return []
+    return await get_messages(db, user_id, session_id, limit=LLM_HISTORY_MESSAGES)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+@router.post("/stream")
+async def stream_message(
+    request: ChatRequest,
+    http_request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    llm: LlmClient = Depends(get_llm_client),
+    cache: ResponseCache = Depends(get_response_cache)
+):
+    """Stream the AI response as server-sent events
+
+    Emits `token` events with text deltas, then `done` once the full reply
+    has been stored, or `error` with the fallback message. If the client
+    disconnects, the upstream call is cancelled and nothing is stored.
+    Only the litellm backend streams tokens; the default emergent backend
+    arrives as a single `token` event with the whole reply.
+    """
+    user_message_data = {
+        "role": "user",
+        "content": request.message,
+        "timestamp": datetime.utcnow()
+    }
+    
+    first_turn = await is_first_turn(db, request.user_id, request.session_id)
+    cached = await cache.get(SYSTEM_MESSAGE, request.message) if first_turn else None
+    
+    # Shed load before committing to a 200 event stream
+    if cached is None and getattr(llm, "saturated", False):
+        raise HTTPException(
+            status_code=503,
+            detail=FALLBACK_RESPONSE,
+            headers={"Retry-After": str(STREAM_RETRY_AFTER_SECONDS)}
+        )
+    
+    async def replay(answer: str):
+        yield answer
+    
+    history = await recent_history(db, request.user_id, request.session_id, first_turn) if cached is None else []
+    
+    async def event_stream():
+        chunks = []
+        if cached is not None:
+            upstream = replay(cached)
+        else:
+            upstream = llm.stream(request.session_id, SYSTEM_MESSAGE, request.message, history)
+        try:
+            async for delta in upstream:
+                if await http_request.is_disconnected():
+                    logger.info(f"Chat stream client disconnected: {request.session_id}")
+                    return
+                chunks.append(delta)
+                yield sse_event("token", {"delta": delta})
+            
+            ai_message_data = {
+                "role": "assistant",
+                "content": "".join(chunks),
+                "timestamp": datetime.utcnow()
+            }
+            if first_turn and cached is None:
+                await cache.set(SYSTEM_MESSAGE, request.message, ai_message_data["content"])
+            await append_messages(
+                db,
+                request.user_id,
+                request.session_id,
+                [user_message_data, ai_message_data]
+            )
+            yield sse_event("done", {"success": True, "session_id": request.session_id})
+        except asyncio.CancelledError:
+            logger.info(f"Chat stream cancelled: {request.session_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Error in AI chat stream: {e}")
+            yield sse_event("error", {
+                "success": False,
+                "response": FALLBACK_RESPONSE,
+                "session_id": request.session_id
+            })
+        finally:
+            await upstream.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/history/{user_id}", response_model=dict)
 async def get_chat_history(
     user_id: str,
     session_id: str = None,
+    before: Optional[datetime] = None,
+    limit: int = 50,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """Get chat history for a user"""
+    """Get chat history for a user, newest page first
+
+    Pass the returned `next_before` as `before` to load older messages.
+    """
     try:
-        query = {"user_id": user_id}
-        if session_id:
-            query["session_id"] = session_id
-        
-        sessions = await db.chat_sessions.find(query).to_list(length=100)
-        
-        if not sessions:
-            return {"messages": []}
+        # Use the specified session or the most recent one
+        if not session_id:
+            session_id = await latest_session_id(db, user_id)
+            if not session_id:
+                return OrjsonResponse({"messages": [], "next_before": None})
         
-        # Return messages from the most recent session or specified session
-        if session_id:
-            session = sessions[0] if sessions else None
-        else:
-            # Get most recent session
-            session = max(sessions, key=lambda x: x.get("updated_at", datetime.min))
-        
-        messages = session.get("messages", []) if session else []
+        limit = max(1, min(limit, 200))
+        messages = await get_messages(db, user_id, session_id, before=before, limit=limit)
+        next_before = messages[0]["timestamp"] if len(messages) == limit else None
         
-        return {"messages": messages}
+        return OrjsonResponse({
+            "session_id": session_id,
+            "messages": messages,
+            "next_before": next_before
+        })
         
     except Exception as e:
         logger.error(f"Error getting chat history: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,91 +1,124 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from responses import OrjsonResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from auth_models import UserRole, CheckinEntry, HealthReport, WithdrawalRequest
+from auth_models import UserRole, CheckinEntry, HealthReport, WithdrawalRequest, PurchaseVerificationBatch, PayoutBatchRequest
 from database import get_database
+from security import (
+    get_token_claims, get_current_principal, require_admin, require_super_admin, invalidate_principal
+)
+from challenge_state import current_day_for
+import health_report
+from cohorts import latest_rollups, refresh_cohort_rollups, get_watermark
+from referrals import get_downline
+from purchases import verify_purchases, MAX_BATCH_SIZE
+from payouts import create_payout_batch, payout_csv
+from etags import weak_etag, etag_matches, not_modified, tagged
+from dashboard_cache import dashboard_cache
+from versions import get_versions, bump_version, seed_versions
+from ledger import ledger_from_doc, apply_ledger_delta, reserve_withdrawal, rebuild_ledgers
 from bson import ObjectId
+import asyncio
+import base64
+import json
 import logging
+import time
 from datetime import datetime
-import jwt
-import os
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = "HS256"
-
-def verify_token(authorization: str = Header(None)):
-    """Verify JWT token from Authorization header"""
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-    
-    token = authorization.replace("Bearer ", "")
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+async def load_users_by_id(db: AsyncIOMotorDatabase, user_ids) -> dict:
+    """Fetch name/phone for many users in one $in query, keyed by id string"""
+    object_ids = list({ObjectId(u) for u in user_ids if ObjectId.is_valid(u)})
+    if not object_ids:
+        return {}
+    users = await db.users.find(
+        {"_id": {"$in": object_ids}},
+        {"name": 1, "phone_number": 1}
+    ).to_list(length=None)
+    return {str(u["_id"]): u for u in users}
 
 # USER DASHBOARD ENDPOINTS
 
+def overview_etag(user: dict, versions: dict, ledger_doc: Optional[dict]) -> str:
+    start_date = versions["challenge_start"]
+    return weak_etag(
+        "overview", user["user_id"],
+        user["name"], user["phone_number"], user.get("referral_code", ""), user.get("health_type"),
+        versions.get("checkins", 0), versions.get("challenge", 0),
+        start_date, current_day_for(start_date) if start_date else 0,
+        ledger_doc.get("updated_at") if ledger_doc else None
+    )
+
+async def load_overview(db: AsyncIOMotorDatabase, user: dict, ledger_doc: Optional[dict]) -> dict:
+    user_id = user["user_id"]
+    challenge, checkins_count = await asyncio.gather(
+        db.challenges.find_one(
+            {"user_id": user_id, "status": "active"},
+            {"start_date": 1}
+        ),
+        db.checkins.count_documents({"user_id": user_id})
+    )
+    ledger = ledger_from_doc(ledger_doc)
+    
+    return {
+        "user": {
+            "name": user["name"],
+            "phone_number": user["phone_number"],
+            "referral_code": user.get("referral_code", ""),
+            "health_type": user.get("health_type")
+        },
+        "challenge": {
+            "enrolled": challenge is not None,
+            "current_day": current_day_for(challenge["start_date"]) if challenge else 0,
+            "total_checkins": checkins_count,
+            "start_date": challenge["start_date"] if challenge else None
+        },
+        "financial": {
+            "total_spent": ledger["total_spent"],
+            "commission_pending": ledger["commission_pending"],
+            "commission_approved": ledger["commission_approved"],
+            "commission_withdrawn": ledger["commission_withdrawn"],
+            "total_referrals": ledger["referral_count"]
+        }
+    }
+
 @router.get("/user/overview")
 async def get_user_overview(
-    authorization: str = Header(None),
+    request: Request,
+    user: dict = Depends(get_current_principal),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Get user dashboard overview"""
     try:
-        payload = verify_token(authorization)
-        user_id = payload["user_id"]
-        
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get active challenge
-        challenge = await db.challenges.find_one({
-            "user_id": user_id,
-            "status": "active"
-        })
-        
-        # Get check-ins count
-        checkins_count = await db.checkins.count_documents({"user_id": user_id})
-        
-        # Get purchases
-        purchases = await db.purchases.find({"user_id": user_id}).to_list(length=100)
-        total_spent = sum([p["amount"] for p in purchases if p["status"] == "verified"])
+        user_id = user["user_id"]
         
-        # Get commission info
-        commissions = await db.commissions.find({"user_id": user_id}).to_list(length=100)
-        commission_pending = sum([c["amount"] for c in commissions if c["status"] == "pending"])
-        commission_approved = sum([c["amount"] for c in commissions if c["status"] == "approved"])
-        
-        # Get referrals
-        referrals = await db.users.count_documents({"referred_by": user_id})
+        # Versions are read before the data they describe, so the ETag is
+        # never newer than the body; a 304 costs these two point reads
+        versions, ledger_doc = await asyncio.gather(
+            get_versions(db, user_id),
+            db.user_ledgers.find_one({"_id": user_id})
+        )
         
-        return {
-            "user": {
-                "name": user["name"],
-                "phone_number": user["phone_number"],
-                "referral_code": user.get("referral_code", ""),
-                "health_type": user.get("health_type")
-            },
-            "challenge": {
-                "enrolled": challenge is not None,
-                "current_day": challenge["current_day"] if challenge else 0,
-                "total_checkins": checkins_count,
-                "start_date": challenge["start_date"] if challenge else None
-            },
-            "financial": {
-                "total_spent": total_spent,
-                "commission_pending": commission_pending,
-                "commission_approved": commission_approved,
-                "total_referrals": referrals
-            }
-        }
+        if versions is None or "challenge_start" not in versions:
+            # First read for a user that predates user_versions: record the
+            # start date read here, unless an enrollment got there first
+            overview = await load_overview(db, user, ledger_doc)
+            challenge_start = overview["challenge"]["start_date"]
+            if not await seed_versions(db, user_id, challenge_start=challenge_start):
+                return OrjsonResponse(overview)
+            versions = {**(versions or {}), "challenge_start": challenge_start}
+            return tagged(overview, overview_etag(user, versions, ledger_doc))
+        
+        etag = overview_etag(user, versions, ledger_doc)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        overview = await dashboard_cache.get_or_load(
+            "overview", user_id, lambda: load_overview(db, user, ledger_doc), version=etag
+        )
+        return tagged(overview, etag)
         
     except HTTPException:
         raise
@@ -95,60 +128,23 @@ async def get_user_overview(
 
 @router.get("/user/health-report")
 async def get_health_report(
-    authorization: str = Header(None),
+    request: Request,
+    claims: dict = Depends(get_token_claims),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Get user health report based on check-ins"""
     try:
-        payload = verify_token(authorization)
-        user_id = payload["user_id"]
-        
-        # Get all check-ins
-        checkins = await db.checkins.find(
-            {"user_id": user_id}
-        ).sort("day", 1).to_list(length=100)
-        
-        if not checkins:
-            return {
-                "total_days": 0,
-                "completion_rate": 0,
-                "comfort_trend": [],
-                "achievements": []
-            }
-        
-        # Calculate stats
-        total_days = len(checkins)
-        completed_tasks = sum([
-            1 for c in checkins 
-            if c["morning_task_completed"] and c["noon_task_completed"] and c["evening_task_completed"]
-        ])
-        completion_rate = (completed_tasks / total_days * 100) if total_days > 0 else 0
-        
-        # Comfort trend
-        comfort_trend = [c["comfort_level"] for c in checkins]
-        average_comfort = sum(comfort_trend) / len(comfort_trend) if comfort_trend else 0
-        
-        # Achievements
-        achievements = []
-        if total_days >= 7:
-            achievements.append("week_1")
-        if total_days >= 14:
-            achievements.append("week_2")
-        if total_days >= 21:
-            achievements.append("week_3")
-        if total_days >= 30:
-            achievements.append("champion")
-        if completion_rate >= 90:
-            achievements.append("perfectionist")
-        
-        return {
-            "total_days": total_days,
-            "completion_rate": round(completion_rate, 2),
-            "average_comfort": round(average_comfort, 2),
-            "comfort_trend": comfort_trend,
-            "achievements": achievements,
-            "latest_checkin": checkins[-1] if checkins else None
-        }
+        user_id = claims["user_id"]
+        
+        # A 304 costs one point read and skips the aggregation
+        versions = await get_versions(db, user_id) or {}
+        etag = weak_etag("health-report", user_id, versions.get("checkins", 0))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        report = await dashboard_cache.get_or_load(
+            "health_report", user_id, lambda: health_report.build_health_report(db, user_id), version=etag
+        )
+        return tagged(report, etag)
         
     except HTTPException:
         raise
@@ -159,13 +155,12 @@ async def get_health_report(
 @router.post("/user/checkin")
 async def submit_checkin(
     checkin: CheckinEntry,
-    authorization: str = Header(None),
+    claims: dict = Depends(get_token_claims),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Submit daily check-in"""
     try:
-        payload = verify_token(authorization)
-        user_id = payload["user_id"]
+        user_id = claims["user_id"]
         
         checkin.user_id = user_id
         
@@ -181,10 +176,14 @@ async def submit_checkin(
                 {"_id": today_checkin["_id"]},
                 {"$set": checkin.dict()}
             )
+            await bump_version(db, user_id, "checkins")
+            await dashboard_cache.invalidate(user_id)
             return {"success": True, "message": "Check-in updated"}
         else:
             # Create new check-in
             await db.checkins.insert_one(checkin.dict())
+            await bump_version(db, user_id, "checkins")
+            await dashboard_cache.invalidate(user_id)
             return {"success": True, "message": "Check-in submitted"}
         
     except HTTPException:
@@ -193,31 +192,48 @@ async def submit_checkin(
         logger.error(f"Error submitting check-in: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/user/referral-tree")
+async def get_referral_tree(
+    refresh: bool = False,
+    claims: dict = Depends(get_token_claims),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Downline size, depth and purchase volume per referral level"""
+    try:
+        return await get_downline(db, claims["user_id"], refresh=refresh)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting referral tree: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/user/withdrawal")
 async def request_withdrawal(
     withdrawal: WithdrawalRequest,
-    authorization: str = Header(None),
+    claims: dict = Depends(get_token_claims),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Request commission withdrawal"""
     try:
-        payload = verify_token(authorization)
-        user_id = payload["user_id"]
+        user_id = claims["user_id"]
         
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+        if withdrawal.amount <= 0:
+            raise HTTPException(status_code=400, detail="Invalid withdrawal amount")
         
-        # Check if user has enough commission
-        commission_approved = user.get("commission_pending", 0.0)
-        if withdrawal.amount > commission_approved:
+        # Reserve the amount against approved, not yet withdrawn commission
+        if not await reserve_withdrawal(db, user_id, withdrawal.amount):
             raise HTTPException(
                 status_code=400,
                 detail="Insufficient commission balance"
             )
         
         withdrawal.user_id = user_id
-        await db.withdrawal_requests.insert_one(withdrawal.dict())
+        try:
+            await db.withdrawal_requests.insert_one(withdrawal.dict())
+        except Exception:
+            await apply_ledger_delta(db, user_id, withdrawal_pending=-withdrawal.amount)
+            raise
         
         return {
             "success": True,
@@ -233,25 +249,89 @@ async def request_withdrawal(
 
 # ADMIN DASHBOARD ENDPOINTS
 
+def encode_cursor(created_at: datetime, object_id: ObjectId) -> str:
+    """Opaque keyset cursor for the (created_at, _id) sort"""
+    raw = json.dumps({"c": created_at.isoformat(), "i": str(object_id)})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["c"]), ObjectId(data["i"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Missing fields on older/quiz-created users count as their model defaults;
+# $in with None keeps these filters on the index.
+def match_with_default(value, default):
+    return {"$in": [value, None]} if value == default else value
+
+USER_COUNT_TTL_SECONDS = 60
+_user_count_cache = {}
+
+async def count_users(db: AsyncIOMotorDatabase, query: dict) -> int:
+    """Estimated total when unfiltered, otherwise a briefly cached count"""
+    if not query:
+        return await db.users.estimated_document_count()
+    key = json.dumps(query, sort_keys=True, default=str)
+    cached = _user_count_cache.get(key)
+    now = time.monotonic()
+    if cached and cached[0] > now:
+        return cached[1]
+    total = await db.users.count_documents(query)
+    _user_count_cache[key] = (now + USER_COUNT_TTL_SECONDS, total)
+    return total
+
 @router.get("/admin/users")
 async def get_all_users(
-    authorization: str = Header(None),
-    skip: int = 0,
+    admin: dict = Depends(require_admin),
+    cursor: Optional[str] = None,
     limit: int = 50,
+    role: Optional[UserRole] = None,
+    challenge_enrolled: Optional[bool] = None,
+    is_active: Optional[bool] = None,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """Get all users (Admin/Super Admin only)"""
+    """Get all users, newest first, with keyset pagination (Admin/Super Admin only)
+
+    `limit=0` returns only the total.
+    """
     try:
-        payload = verify_token(authorization)
-        role = payload.get("role")
-        
-        if role not in [UserRole.ADMIN.value, UserRole.SUPER_ADMIN.value]:
-            raise HTTPException(status_code=403, detail="Access denied")
+        limit = max(0, min(limit, 100))
+        
+        query = {}
+        if role is not None:
+            query["role"] = match_with_default(role.value, UserRole.USER.value)
+        if challenge_enrolled is not None:
+            query["challenge_enrolled"] = match_with_default(challenge_enrolled, False)
+        if is_active is not None:
+            query["is_active"] = match_with_default(is_active, True)
+        
+        page_query = dict(query)
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            page_query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": last_id}}
+            ]
+        
+        users = []
+        if limit:
+            users = await db.users.find(
+                page_query,
+                {
+                    "name": 1, "phone_number": 1, "role": 1, "challenge_enrolled": 1,
+                    "total_referrals": 1, "total_commission": 1, "is_active": 1, "created_at": 1
+                }
+            ).sort([("created_at", -1), ("_id", -1)]).limit(limit).to_list(length=limit)
+        total = await count_users(db, query)
         
-        users = await db.users.find().skip(skip).limit(limit).to_list(length=limit)
-        total = await db.users.count_documents({})
+        next_cursor = None
+        if limit and len(users) == limit:
+            next_cursor = encode_cursor(users[-1]["created_at"], users[-1]["_id"])
         
-        return {
+        return OrjsonResponse({
             "users": [
                 {
                     "id": str(u["_id"]),
@@ -267,9 +347,9 @@ async def get_all_users(
                 for u in users
             ],
             "total": total,
-            "skip": skip,
-            "limit": limit
-        }
+            "limit": limit,
+            "next_cursor": next_cursor
+        })
         
     except HTTPException:
         raise
@@ -280,22 +360,18 @@ async def get_all_users(
 @router.delete("/admin/users/{user_id}")
 async def delete_user(
     user_id: str,
-    authorization: str = Header(None),
+    admin: dict = Depends(require_super_admin),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Delete user (Super Admin only)"""
     try:
-        payload = verify_token(authorization)
-        role = payload.get("role")
-        
-        if role != UserRole.SUPER_ADMIN.value:
-            raise HTTPException(status_code=403, detail="Super Admin access required")
-        
         result = await db.users.delete_one({"_id": ObjectId(user_id)})
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
         
+        await invalidate_principal(user_id)
+        
         return {"success": True, "message": "User deleted"}
         
     except HTTPException:
@@ -304,28 +380,48 @@ async def delete_user(
         logger.error(f"Error deleting user: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/admin/users/{user_id}/referral-tree")
+async def get_user_referral_tree(
+    user_id: str,
+    admin: dict = Depends(require_admin),
+    refresh: bool = False,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Referral tree summary of any user (Admin/Super Admin only)"""
+    try:
+        if not ObjectId.is_valid(user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+        return await get_downline(db, user_id, refresh=refresh)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting referral tree: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/admin/purchases")
 async def get_pending_purchases(
-    authorization: str = Header(None),
+    admin: dict = Depends(require_admin),
     status: str = "pending",
+    skip: int = 0,
+    limit: int = 50,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Get purchases for verification (Admin/Super Admin only)"""
     try:
-        payload = verify_token(authorization)
-        role = payload.get("role")
-        
-        if role not in [UserRole.ADMIN.value, UserRole.SUPER_ADMIN.value]:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        purchases = await db.purchases.find(
-            {"status": status}
-        ).sort("created_at", -1).to_list(length=100)
+        limit = max(1, min(limit, 100))
+        purchases, total = await asyncio.gather(
+            db.purchases.find(
+                {"status": status}
+            ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit),
+            db.purchases.count_documents({"status": status})
+        )
         
-        # Get user info for each purchase
+        # Resolve all buyers in a single query
+        users = await load_users_by_id(db, [p["user_id"] for p in purchases])
         result = []
         for p in purchases:
-            user = await db.users.find_one({"_id": ObjectId(p["user_id"])})
+            user = users.get(p["user_id"])
             result.append({
                 "id": str(p["_id"]),
                 "user_name": user["name"] if user else "Unknown",
@@ -337,7 +433,12 @@ async def get_pending_purchases(
                 "created_at": p["created_at"]
             })
         
-        return {"purchases": result}
+        return OrjsonResponse({
+            "purchases": result,
+            "total": total,
+            "skip": skip,
+            "limit": limit
+        })
         
     except HTTPException:
         raise
@@ -349,60 +450,19 @@ async def get_pending_purchases(
 async def verify_purchase(
     purchase_id: str,
     approved: bool,
-    authorization: str = Header(None),
+    admin: dict = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Verify purchase (Admin/Super Admin only)"""
     try:
-        payload = verify_token(authorization)
-        role = payload.get("role")
-        admin_id = payload["user_id"]
-        
-        if role not in [UserRole.ADMIN.value, UserRole.SUPER_ADMIN.value]:
-            raise HTTPException(status_code=403, detail="Access denied")
+        admin_id = admin["user_id"]
         
-        purchase = await db.purchases.find_one({"_id": ObjectId(purchase_id)})
-        if not purchase:
+        result = (await verify_purchases(db, admin_id, [{"purchase_id": purchase_id, "approved": approved}]))[0]
+        if result["result"] in ("invalid_id", "not_found"):
             raise HTTPException(status_code=404, detail="Purchase not found")
-        
-        new_status = "verified" if approved else "cancelled"
-        
-        await db.purchases.update_one(
-            {"_id": ObjectId(purchase_id)},
-            {
-                "$set": {
-                    "status": new_status,
-                    "verified_by": admin_id,
-                    "verified_at": datetime.utcnow()
-                }
-            }
-        )
-        
-        # If verified, create commission for referrer
-        if approved:
-            user = await db.users.find_one({"_id": ObjectId(purchase["user_id"])})
-            if user and user.get("referred_by"):
-                commission_amount = purchase["amount"] * 0.10  # 10% commission
-                commission_data = {
-                    "user_id": user["referred_by"],
-                    "from_user_id": purchase["user_id"],
-                    "purchase_id": purchase_id,
-                    "amount": commission_amount,
-                    "status": "approved",
-                    "created_at": datetime.utcnow()
-                }
-                await db.commissions.insert_one(commission_data)
-                
-                # Update referrer's commission
-                await db.users.update_one(
-                    {"_id": ObjectId(user["referred_by"])},
-                    {
-                        "$inc": {
-                            "commission_pending": commission_amount,
-                            "total_commission": commission_amount
-                        }
-                    }
-                )
+        if result["result"] == "already_processed":
+            raise HTTPException(status_code=400, detail="Purchase already processed")
+        new_status = result["result"]
         
         return {"success": True, "message": f"Purchase {new_status}"}
         
@@ -412,27 +472,58 @@ async def verify_purchase(
         logger.error(f"Error verifying purchase: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/admin/purchases/verify-batch")
+async def verify_purchase_batch(
+    batch: PurchaseVerificationBatch,
+    admin: dict = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Verify or cancel many purchases in one transaction (Admin/Super Admin only)
+
+    Purchases that are no longer pending are reported as
+    `already_processed` and left untouched, so a batch can be resubmitted.
+    """
+    try:
+        if not batch.items:
+            raise HTTPException(status_code=400, detail="No purchases given")
+        if len(batch.items) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} purchases per batch")
+        
+        results = await verify_purchases(db, admin["user_id"], [item.dict() for item in batch.items])
+        summary = {}
+        for result in results:
+            summary[result["result"]] = summary.get(result["result"], 0) + 1
+        return OrjsonResponse({"success": True, "summary": summary, "results": results})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error verifying purchase batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/admin/withdrawals")
 async def get_withdrawal_requests(
-    authorization: str = Header(None),
+    admin: dict = Depends(require_admin),
     status: str = "pending",
+    skip: int = 0,
+    limit: int = 50,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Get withdrawal requests (Admin/Super Admin only)"""
     try:
-        payload = verify_token(authorization)
-        role = payload.get("role")
-        
-        if role not in [UserRole.ADMIN.value, UserRole.SUPER_ADMIN.value]:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        withdrawals = await db.withdrawal_requests.find(
-            {"status": status}
-        ).sort("created_at", -1).to_list(length=100)
+        limit = max(1, min(limit, 100))
+        withdrawals, total = await asyncio.gather(
+            db.withdrawal_requests.find(
+                {"status": status}
+            ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit),
+            db.withdrawal_requests.count_documents({"status": status})
+        )
         
+        # Resolve all requesters in a single query
+        users = await load_users_by_id(db, [w["user_id"] for w in withdrawals])
         result = []
         for w in withdrawals:
-            user = await db.users.find_one({"_id": ObjectId(w["user_id"])})
+            user = users.get(w["user_id"])
             result.append({
                 "id": str(w["_id"]),
                 "user_name": user["name"] if user else "Unknown",
@@ -445,7 +536,12 @@ async def get_withdrawal_requests(
                 "created_at": w["created_at"]
             })
         
-        return {"withdrawals": result}
+        return OrjsonResponse({
+            "withdrawals": result,
+            "total": total,
+            "skip": skip,
+            "limit": limit
+        })
         
     except HTTPException:
         raise
@@ -458,17 +554,12 @@ async def process_withdrawal(
     withdrawal_id: str,
     approved: bool,
     note: Optional[str] = None,
-    authorization: str = Header(None),
+    admin: dict = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Process withdrawal request (Admin/Super Admin only)"""
     try:
-        payload = verify_token(authorization)
-        role = payload.get("role")
-        admin_id = payload["user_id"]
-        
-        if role not in [UserRole.ADMIN.value, UserRole.SUPER_ADMIN.value]:
-            raise HTTPException(status_code=403, detail="Access denied")
+        admin_id = admin["user_id"]
         
         withdrawal = await db.withdrawal_requests.find_one({"_id": ObjectId(withdrawal_id)})
         if not withdrawal:
@@ -476,8 +567,9 @@ async def process_withdrawal(
         
         new_status = "paid" if approved else "rejected"
         
-        await db.withdrawal_requests.update_one(
-            {"_id": ObjectId(withdrawal_id)},
+        # Only a pending request can be processed, so balances move once
+        result = await db.withdrawal_requests.update_one(
+            {"_id": ObjectId(withdrawal_id), "status": "pending"},
             {
                 "$set": {
                     "status": new_status,
@@ -487,6 +579,16 @@ async def process_withdrawal(
                 }
             }
         )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=400, detail="Withdrawal already processed")
+        
+        # Release the reservation; a paid request moves it to withdrawn
+        await apply_ledger_delta(
+            db,
+            withdrawal["user_id"],
+            withdrawal_pending=-withdrawal["amount"],
+            commission_withdrawn=withdrawal["amount"] if approved else 0.0
+        )
         
         # Update user's commission balance
         if approved:
@@ -499,6 +601,8 @@ async def process_withdrawal(
                     }
                 }
             )
+            await invalidate_principal(withdrawal["user_id"])
+        await dashboard_cache.invalidate(withdrawal["user_id"], "overview")
         
         return {"success": True, "message": f"Withdrawal {new_status}"}
         
@@ -506,4 +610,140 @@ async def process_withdrawal(
         raise
     except Exception as e:
         logger.error(f"Error processing withdrawal: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def payout_csv_response(db: AsyncIOMotorDatabase, batch: dict) -> StreamingResponse:
+    batch_id = str(batch["_id"])
+    return StreamingResponse(
+        payout_csv(db, batch["_id"]),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="payout-{batch_id}.csv"',
+            "X-Payout-Batch-Id": batch_id,
+            "X-Payout-Count": str(batch["withdrawal_count"]),
+            "X-Payout-Total": f"{batch['total_amount']:.2f}"
+        }
+    )
+
+@router.post("/admin/payouts")
+async def run_payout_batch(
+    request: PayoutBatchRequest,
+    admin: dict = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Pay out pending withdrawals as one batch and stream its bank-transfer CSV (Admin/Super Admin only)"""
+    try:
+        batch = await create_payout_batch(
+            db,
+            admin["user_id"],
+            withdrawal_ids=request.withdrawal_ids,
+            created_before=request.created_before,
+            note=request.note
+        )
+        if batch is None:
+            raise HTTPException(status_code=400, detail="No pending withdrawals to pay out")
+        return payout_csv_response(db, batch)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error running payout batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/admin/payouts")
+async def get_payout_batches(
+    admin: dict = Depends(require_admin),
+    skip: int = 0,
+    limit: int = 20,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Past payout batches, newest first (Admin/Super Admin only)"""
+    try:
+        limit = max(1, min(limit, 100))
+        batches, total = await asyncio.gather(
+            db.payout_batches.find().sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit),
+            db.payout_batches.estimated_document_count()
+        )
+        for batch in batches:
+            batch["id"] = str(batch.pop("_id"))
+        return OrjsonResponse({"batches": batches, "total": total, "skip": skip, "limit": limit})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting payout batches: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/admin/payouts/{batch_id}/csv")
+async def download_payout_csv(
+    batch_id: str,
+    admin: dict = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Download a payout batch's bank-transfer CSV again (Admin/Super Admin only)"""
+    try:
+        batch = await db.payout_batches.find_one({"_id": ObjectId(batch_id)}) if ObjectId.is_valid(batch_id) else None
+        if not batch:
+            raise HTTPException(status_code=404, detail="Payout batch not found")
+        return payout_csv_response(db, batch)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting payout batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/admin/ledger/reconcile")
+async def reconcile_ledgers(
+    admin: dict = Depends(require_super_admin),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Rebuild all user ledger summaries (Super Admin only)"""
+    try:
+        result = await rebuild_ledgers(db)
+        return {"success": True, **result}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reconciling ledgers: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/analytics/cohorts")
+async def get_cohort_analytics(
+    admin: dict = Depends(require_admin),
+    health_type: Optional[str] = None,
+    weeks: int = 12,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Precomputed retention, completion and comfort per health type x enrollment week"""
+    try:
+        cohorts, watermark = await asyncio.gather(
+            latest_rollups(db, health_type, max(1, min(weeks, 104))),
+            get_watermark(db)
+        )
+        return OrjsonResponse({"cohorts": cohorts, "data_through": watermark})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting cohort analytics: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/admin/analytics/cohorts/refresh")
+async def refresh_cohort_analytics(
+    admin: dict = Depends(require_super_admin),
+    full: bool = False,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Run the cohort rollup job now; `full` reprocesses all history (Super Admin only)"""
+    try:
+        result = await refresh_cohort_rollups(db, full=full)
+        return {"success": True, **result}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error refreshing cohort analytics: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException, Depends
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import get_database
+from security import require_admin
+from indexes import index_report
+from llm import get_response_cache, get_llm_gateway
+from dashboard_cache import dashboard_cache
+import compression
+import ratelimit
+import passwords
+import scheduler
+import database
+import logging
+
+logger = logging.getLogger(__name__)
+# Operational internals; every endpoint is admin-only
+router = APIRouter(prefix="/metrics", tags=["metrics"], dependencies=[Depends(require_admin)])
+
+@router.get("/db-pool")
+async def get_db_pool_metrics():
+    """MongoDB connection pool usage for this worker"""
+    return {
+        "config": {
+            "max_pool_size": database.MAX_POOL_SIZE,
+            "min_pool_size": database.MIN_POOL_SIZE,
+            "max_idle_time_ms": database.MAX_IDLE_TIME_MS,
+            "server_selection_timeout_ms": database.SERVER_SELECTION_TIMEOUT_MS,
+            "wait_queue_timeout_ms": database.WAIT_QUEUE_TIMEOUT_MS
+        },
+        **database.pool_metrics.snapshot()
+    }
+
+@router.get("/indexes")
+async def get_index_report(
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Index usage and COLLSCAN check for the routes' hot queries (Admin only)"""
+    try:
+        return await index_report(db)
+    except Exception as e:
+        logger.error(f"Error building index report: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/llm-cache")
+async def get_llm_cache_metrics():
+    """Doktor AI answer cache hit/miss counters for this worker"""
+    return get_response_cache().stats()
+
+@router.get("/llm-gateway")
+async def get_llm_gateway_metrics():
+    """In-flight LLM calls, queue depth and queue wait times for this worker"""
+    return get_llm_gateway().stats()
+
+@router.get("/password-hashing")
+async def get_password_hashing_metrics():
+    """Time spent in bcrypt on the hashing thread pool"""
+    return passwords.metrics.snapshot()
+
+@router.get("/jobs")
+async def get_job_metrics():
+    """Background job runs, durations and last results for this worker"""
+    return {name: job.status() for name, job in scheduler.jobs.items()}
+
+@router.get("/compression")
+async def get_compression_metrics():
+    """Compressed vs skipped responses and bytes saved by this worker"""
+    return compression.stats.snapshot()
+
+@router.get("/dashboard-cache")
+async def get_dashboard_cache_metrics():
+    """Dashboard view cache hit ratio, stale serves and loads for this worker"""
+    return dashboard_cache.stats()
+
+@router.get("/rate-limits")
+async def get_rate_limit_metrics():
+    """Rate-limited and shed requests, in-flight count and loop lag for this worker"""
+    return ratelimit.stats.snapshot()
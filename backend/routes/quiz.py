@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import QuizAnswer, QuizResult
-from database import get_database
+from database import get_database, upsert_one
+from etags import weak_etag, etag_matches, not_modified, tagged
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,38 +15,26 @@ async def submit_quiz(
 ):
     """Submit quiz answers and get personalized recommendation"""
     try:
-        # Check if user exists
-        user = await db.users.find_one({"phone_number": quiz_answer.phone_number})
-        
-        if not user:
-            # Create new user
-            user_data = {
-                "phone_number": quiz_answer.phone_number,
-                "name": quiz_answer.name,
-                "health_type": quiz_answer.health_type,
-                "health_score": quiz_answer.score,
-                "quiz_date": quiz_answer.timestamp,
-                "challenge_enrolled": False,
-                "created_at": quiz_answer.timestamp,
-                "updated_at": quiz_answer.timestamp
-            }
-            result = await db.users.insert_one(user_data)
-            user_id = str(result.inserted_id)
-        else:
-            # Update existing user
-            user_id = str(user["_id"])
-            await db.users.update_one(
-                {"_id": user["_id"]},
-                {
-                    "$set": {
-                        "name": quiz_answer.name,
-                        "health_type": quiz_answer.health_type,
-                        "health_score": quiz_answer.score,
-                        "quiz_date": quiz_answer.timestamp,
-                        "updated_at": quiz_answer.timestamp
-                    }
+        # Create or update the user in one round trip (unique phone_number)
+        user = await upsert_one(
+            db.users,
+            {"phone_number": quiz_answer.phone_number},
+            {
+                "$set": {
+                    "name": quiz_answer.name,
+                    "health_type": quiz_answer.health_type,
+                    "health_score": quiz_answer.score,
+                    "quiz_date": quiz_answer.timestamp,
+                    "updated_at": quiz_answer.timestamp
+                },
+                "$setOnInsert": {
+                    "challenge_enrolled": False,
+                    "created_at": quiz_answer.timestamp
                 }
-            )
+            },
+            projection={"_id": 1}
+        )
+        user_id = str(user["_id"])
         
         # Generate recommendation based on health type
         recommendations = {
@@ -91,21 +80,30 @@ async def submit_quiz(
 @router.get("/result/{user_id}", response_model=dict)
 async def get_quiz_result(
     user_id: str,
+    request: Request,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Get quiz result for a specific user"""
     try:
-        result = await db.quiz_results.find_one({"user_id": user_id})
+        result = await db.quiz_results.find_one(
+            {"user_id": user_id},
+            {"score": 1, "health_type": 1, "timestamp": 1, "recommendation": 1}
+        )
         
         if not result:
             raise HTTPException(status_code=404, detail="Quiz result not found")
         
-        return {
+        # Results are insert-only, so the document id is its version
+        etag = weak_etag("quiz-result", user_id, result["_id"], result["timestamp"])
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        
+        return tagged({
             "score": result["score"],
             "health_type": result["health_type"],
             "timestamp": result["timestamp"],
             "recommendation": result.get("recommendation", "")
-        }
+        }, etag)
         
     except HTTPException:
         raise
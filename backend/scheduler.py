@@ -0,0 +1,74 @@
+"""Periodic background jobs run inside each API worker.
+
+Jobs are started and cancelled by the FastAPI lifespan (see server.py).
+Every job must be idempotent: with several uvicorn workers, each one runs
+its own copy of the schedule.
+"""
+from database import get_database
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PeriodicJob:
+    def __init__(self, name: str, interval: float, fn: Callable[..., Awaitable[dict]]):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.runs = 0
+        self.failures = 0
+        self.last_started_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_result: Optional[dict] = None
+        self.last_error: Optional[str] = None
+
+    async def run_once(self):
+        self.last_started_at = datetime.utcnow()
+        started = asyncio.get_running_loop().time()
+        try:
+            self.last_result = await self.fn(get_database())
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.error(f"Job {self.name} failed: {e}")
+        finally:
+            self.runs += 1
+            self.last_duration_ms = round((asyncio.get_running_loop().time() - started) * 1000, 3)
+
+    async def run_forever(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def status(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_started_at": self.last_started_at,
+            "last_duration_ms": self.last_duration_ms,
+            "last_result": self.last_result,
+            "last_error": self.last_error
+        }
+
+jobs: Dict[str, PeriodicJob] = {}
+_tasks: List[asyncio.Task] = []
+
+def register_job(name: str, interval: float, fn: Callable[..., Awaitable[dict]]):
+    """Register a job; a non-positive interval disables it"""
+    if interval > 0:
+        jobs[name] = PeriodicJob(name, interval, fn)
+
+def start_jobs():
+    for job in jobs.values():
+        _tasks.append(asyncio.create_task(job.run_forever(), name=f"job:{job.name}"))
+        logger.info(f"Started job {job.name} every {job.interval}s")
+
+async def stop_jobs():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -0,0 +1,113 @@
+"""JWT authentication dependencies.
+
+Tokens are decoded once and their verified claims cached until `exp`.
+`get_current_principal` adds a short-lived cache of a slim user record so
+dashboard calls skip the users lookup; call `invalidate_principal` when a
+user's cached fields change or the user is deactivated or deleted. The
+caches are per-process, so other workers see a change within
+AUTH_PRINCIPAL_TTL_SECONDS.
+"""
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from auth_models import UserRole
+from cache import MemoryCacheBackend
+from database import get_database
+from bson import ObjectId
+from datetime import datetime, timedelta
+from typing import Optional
+import jwt
+import os
+import time
+
+# JWT settings
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_DAYS = 30
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+AUTH_PRINCIPAL_TTL_SECONDS = float(os.getenv("AUTH_PRINCIPAL_TTL_SECONDS", "30"))
+
+ADMIN_ROLES = [UserRole.ADMIN.value, UserRole.SUPER_ADMIN.value]
+
+PRINCIPAL_FIELDS = {
+    "name": 1, "phone_number": 1, "email": 1, "role": 1, "is_active": 1,
+    "referral_code": 1, "health_type": 1, "total_commission": 1, "commission_pending": 1
+}
+
+_claims_cache = MemoryCacheBackend(max_entries=AUTH_TOKEN_CACHE_SIZE)
+_principal_cache = MemoryCacheBackend(max_entries=AUTH_PRINCIPAL_CACHE_SIZE)
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+def create_access_token(data: dict):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+async def decode_token(token: str) -> dict:
+    """Verify a JWT, reusing the cached claims of tokens seen before"""
+    claims = await _claims_cache.get(token)
+    if claims is not None:
+        return claims
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if not claims.get("user_id"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    ttl = claims["exp"] - time.time() if "exp" in claims else AUTH_PRINCIPAL_TTL_SECONDS
+    if ttl > 0:
+        await _claims_cache.set(token, claims, ttl)
+    return claims
+
+async def get_token_claims(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> dict:
+    """Claims from the `Authorization: Bearer` header"""
+    if not credentials or credentials.scheme.lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    return await decode_token(credentials.credentials)
+
+async def require_admin(claims: dict = Depends(get_token_claims)) -> dict:
+    if claims.get("role") not in ADMIN_ROLES:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return claims
+
+async def require_super_admin(claims: dict = Depends(get_token_claims)) -> dict:
+    if claims.get("role") != UserRole.SUPER_ADMIN.value:
+        raise HTTPException(status_code=403, detail="Super Admin access required")
+    return claims
+
+async def load_principal(db: AsyncIOMotorDatabase, user_id: str) -> Optional[dict]:
+    principal = await _principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    if not ObjectId.is_valid(user_id):
+        return None
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, PRINCIPAL_FIELDS)
+    if not user:
+        return None
+    principal = {"user_id": str(user.pop("_id")), **user}
+    await _principal_cache.set(user_id, principal, AUTH_PRINCIPAL_TTL_SECONDS)
+    return principal
+
+async def get_current_principal(
+    claims: dict = Depends(get_token_claims),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+) -> dict:
+    """The authenticated, active user's slim record"""
+    principal = await load_principal(db, claims["user_id"])
+    if not principal:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not principal.get("is_active", True):
+        raise HTTPException(status_code=403, detail="Account is deactivated")
+    return principal
+
+async def invalidate_principal(user_id: str):
+    await _principal_cache.delete(user_id)
@@ -1,23 +1,81 @@
 from fastapi import FastAPI, APIRouter
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
 from routes import quiz, challenge, chat
+from database import connect_to_mongo, close_mongo_connection
+from indexes import ensure_indexes
+from responses import OrjsonResponse
+from compression import CompressionMiddleware
+from ratelimit import RateLimitMiddleware
+from challenge_state import advance_challenge_days
+from cohorts import refresh_cohort_rollups
+from ledger import backfill_ledgers
+from chat_store import migrate_chat_sessions
+from referrals import backfill_referrals
+import scheduler
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db_instance = client[os.environ['DB_NAME']]
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("JATES9 Ecosystem API starting up...")
+    db = await connect_to_mongo()
+    logger.info(f"Connected to MongoDB: {os.environ.get('MONGO_URL', 'mongodb://localhost:27017')}")
+    if os.environ.get('MONGO_ENSURE_INDEXES', 'true').lower() == 'true':
+        await ensure_indexes(db)
+    scheduler.start_jobs()
+    yield
+    logger.info("Shutting down JATES9 Ecosystem API...")
+    await scheduler.stop_jobs()
+    close_mongo_connection()
+
+# Background jobs (interval in seconds, 0 disables)
+scheduler.register_job(
+    "challenge-day-advance",
+    float(os.environ.get('CHALLENGE_DAY_JOB_INTERVAL_SECONDS', '3600')),
+    advance_challenge_days
+)
+scheduler.register_job(
+    "ledger-backfill",
+    float(os.environ.get('LEDGER_BACKFILL_INTERVAL_SECONDS', '3600')),
+    backfill_ledgers
+)
+scheduler.register_job(
+    "referral-backfill",
+    float(os.environ.get('REFERRAL_BACKFILL_INTERVAL_SECONDS', '3600')),
+    backfill_referrals
+)
+scheduler.register_job(
+    "chat-migration",
+    float(os.environ.get('CHAT_MIGRATION_INTERVAL_SECONDS', '3600')),
+    migrate_chat_sessions
+)
+scheduler.register_job(
+    "cohort-rollups",
+    float(os.environ.get('COHORT_ROLLUP_INTERVAL_SECONDS', '86400')),
+    refresh_cohort_rollups
+)
 
 # Create the main app without a prefix
-app = FastAPI(title="JATES9 Ecosystem API", version="1.0.0")
+app = FastAPI(
+    title="JATES9 Ecosystem API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=OrjsonResponse
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -39,17 +97,25 @@ async def health_check():
     }
 
 # Include feature routers
-from routes import auth, dashboard
+from routes import auth, dashboard, metrics
 
 api_router.include_router(quiz.router)
 api_router.include_router(challenge.router)
 api_router.include_router(chat.router)
 api_router.include_router(auth.router)
 api_router.include_router(dashboard.router)
+api_router.include_router(metrics.router)
 
 # Include the main API router in the app
 app.include_router(api_router)
 
+# Compress large bodies (gzip/Brotli); added before CORS so it runs inside it
+app.add_middleware(CompressionMiddleware)
+
+# Per-client token buckets and overload shedding; inside CORS so 429/503
+# responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -58,20 +124,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-@app.on_event("startup")
-async def startup_event():
-    logger.info("JATES9 Ecosystem API starting up...")
-    logger.info(f"Connected to MongoDB: {os.environ['MONGO_URL']}")
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    logger.info("Shutting down JATES9 Ecosystem API...")
-    client.close()
\ No newline at end of file
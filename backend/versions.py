@@ -0,0 +1,51 @@
+"""Per-user data versions for conditional GETs.
+
+`user_versions` holds one document per user (keyed by the user id string)
+with a counter per data set that handlers bump after writing it:
+
+    checkins          dashboard check-ins (submit_checkin)
+    challenge         challenge enrollment and completion
+
+plus `challenge_start`, the start date of the active challenge (None when
+there is none), so time-derived fields such as the current challenge day
+can be put into an ETag without reading the challenge.
+
+Documents are created by the first bump, or seeded by the first full read
+of an endpoint for users that predate this collection. A missing document
+or field means "unknown": callers skip the conditional shortcut.
+"""
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+from typing import Iterable, Optional
+
+async def get_versions(db: AsyncIOMotorDatabase, user_id: str) -> Optional[dict]:
+    return await db.user_versions.find_one({"_id": user_id})
+
+async def bump_version(db: AsyncIOMotorDatabase, user_id: str, *counters: str, session=None, **fields):
+    """Increment `counters` (and set `fields`) for one user, creating the document"""
+    update = {"$inc": {counter: 1 for counter in counters}}
+    if fields:
+        update["$set"] = fields
+    await db.user_versions.update_one({"_id": user_id}, update, upsert=True, session=session)
+
+async def bump_versions(db: AsyncIOMotorDatabase, user_ids: Iterable[str], *counters: str, **fields):
+    """Bump many existing documents; unseeded users have nothing to invalidate"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    update = {"$inc": {counter: 1 for counter in counters}}
+    if fields:
+        update["$set"] = fields
+    await db.user_versions.update_many({"_id": {"$in": user_ids}}, update)
+
+async def seed_versions(db: AsyncIOMotorDatabase, user_id: str, **fields) -> bool:
+    """Set `fields` unless a concurrent writer already did; True when set here"""
+    try:
+        await db.user_versions.update_one(
+            {"_id": user_id, **{field: {"$exists": False} for field in fields}},
+            {"$set": fields},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
@@ -29,8 +29,8 @@ const AdminDashboard = () => {
 
       setStats({
         totalUsers: usersRes.data.total || 0,
-        pendingPurchases: purchasesRes.data.purchases?.length || 0,
-        pendingWithdrawals: withdrawalsRes.data.withdrawals?.length || 0,
+        pendingPurchases: purchasesRes.data.total || 0,
+        pendingWithdrawals: withdrawalsRes.data.total || 0,
         totalRevenue: 0
       });
     } catch (error) {
@@ -0,0 +1,52 @@
+"""Shared fixtures: the backend against an in-memory MongoDB.
+
+`db` is a fresh mongomock-motor database installed as `database.db`, so
+routes and module functions see the same data. Async tests run on the
+anyio pytest plugin (`@pytest.mark.anyio`). Nothing here needs a network:
+the LLM backend is the local fake and transactions are off, as on a
+standalone server.
+"""
+from pathlib import Path
+import os
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_FAKE_DELAY", "0")
+os.environ.setdefault("LLM_CACHE_BACKEND", "none")
+os.environ.setdefault("MONGO_TRANSACTIONS", "false")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+from mongomock_motor import AsyncMongoMockClient
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    import database
+    test_db = AsyncMongoMockClient()["jates9_test"]
+    monkeypatch.setattr(database, "db", test_db)
+    return test_db
+
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+    import server
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def auth_headers():
+    from security import create_access_token
+
+    def headers(user_id: str, role: str = "user") -> dict:
+        return {"Authorization": "Bearer " + create_access_token({"user_id": user_id, "role": role})}
+    return headers
@@ -0,0 +1,96 @@
+import orjson
+import pytest
+
+from llm import FakeLlmClient, LiteLlmClient, LlmClient, LlmGateway, ResponseCache, get_llm_client, get_response_cache
+from routes.chat import FALLBACK_RESPONSE, STREAM_RETRY_AFTER_SECONDS
+
+
+class RecordingLlmClient(FakeLlmClient):
+    def __init__(self, reply: str):
+        super().__init__(reply=reply)
+        self.histories = []
+
+    async def stream(self, session_id, system_message, text, history=None):
+        self.histories.append(history)
+        async for delta in super().stream(session_id, system_message, text, history):
+            yield delta
+
+
+class FailingLlmClient(LlmClient):
+    async def complete(self, session_id, system_message, text, history=None):
+        raise RuntimeError("upstream unavailable")
+
+
+def use_llm(client, llm: LlmClient):
+    client.app.dependency_overrides[get_llm_client] = lambda: llm
+    client.app.dependency_overrides[get_response_cache] = lambda: ResponseCache(None)
+
+
+def sse_events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], orjson.loads(lines["data"])))
+    return events
+
+
+def chat(message: str, user_id: str = "u1", session_id: str = "s1") -> dict:
+    return {"user_id": user_id, "session_id": session_id, "message": message}
+
+
+def test_stream_emits_tokens_in_order_then_done(client):
+    use_llm(client, LlmGateway(FakeLlmClient(reply="satu dua tiga")))
+
+    response = client.post("/api/chat/stream", json=chat("halo"))
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response.text)
+    assert events[:-1] == [("token", {"delta": "satu"}), ("token", {"delta": " dua"}), ("token", {"delta": " tiga"})]
+    assert events[-1] == ("done", {"success": True, "session_id": "s1"})
+    history = client.get("/api/chat/history/u1", params={"session_id": "s1"}).json()
+    assert [(m["role"], m["content"]) for m in history["messages"]] == [("user", "halo"), ("assistant", "satu dua tiga")]
+
+
+def test_stream_passes_recent_turns_as_history(client):
+    llm = RecordingLlmClient(reply="jawaban")
+    use_llm(client, LlmGateway(llm))
+
+    client.post("/api/chat/stream", json=chat("pertama"))
+    client.post("/api/chat/stream", json=chat("kedua"))
+
+    assert llm.histories[0] == []
+    assert [(m["role"], m["content"]) for m in llm.histories[1]] == [("user", "pertama"), ("assistant", "jawaban")]
+
+
+def test_saturated_gateway_sheds_stream_with_retry_after(client):
+    # No free slot and no queue room: the next request would be shed
+    use_llm(client, LlmGateway(FakeLlmClient(), max_concurrency=0, max_queue=0))
+
+    response = client.post("/api/chat/stream", json=chat("halo"))
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(STREAM_RETRY_AFTER_SECONDS)
+    assert response.json()["detail"] == FALLBACK_RESPONSE
+
+
+def test_send_message_falls_back_when_llm_fails(client):
+    use_llm(client, LlmGateway(FailingLlmClient()))
+
+    response = client.post("/api/chat/message", json=chat("halo"))
+
+    assert response.status_code == 200
+    assert response.json() == {"success": False, "response": FALLBACK_RESPONSE, "session_id": "s1"}
+
+
+def test_litellm_request_includes_history():
+    request = LiteLlmClient(api_key="k")._request(
+        "sys", "kedua", [{"role": "user", "content": "pertama", "timestamp": None}], stream=True
+    )
+
+    assert request["messages"] == [
+        {"role": "system", "content": "sys"},
+        {"role": "user", "content": "pertama"},
+        {"role": "user", "content": "kedua"},
+    ]
+    assert request["stream"] is True
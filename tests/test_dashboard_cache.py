@@ -0,0 +1,190 @@
+import asyncio
+
+import pytest
+
+from cache import MemoryCacheBackend
+from dashboard_cache import ViewCache
+
+pytestmark = pytest.mark.anyio
+
+
+class Loader:
+    """Counts calls; each load returns the next numbered value"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        value = {"load": self.calls}
+        await asyncio.sleep(self.delay)
+        return value
+
+
+def worker(shared: MemoryCacheBackend, **kwargs) -> ViewCache:
+    """One API worker: its own local tier over the shared one"""
+    return ViewCache(MemoryCacheBackend(), shared, **kwargs)
+
+
+async def test_concurrent_misses_share_one_load():
+    cache = worker(MemoryCacheBackend())
+    loader = Loader(delay=0.01)
+
+    values = await asyncio.gather(*(cache.get_or_load("overview", "u1", loader, version="v1") for _ in range(5)))
+
+    assert values == [{"load": 1}] * 5
+    assert loader.calls == 1
+    assert cache.stats()["coalesced_loads"] == 4
+
+
+async def test_hit_serves_the_stored_version():
+    cache = worker(MemoryCacheBackend())
+    loader = Loader()
+
+    await cache.get_or_load("overview", "u1", loader, version="v1")
+    assert await cache.get_or_load("overview", "u1", loader, version="v1") == {"load": 1}
+
+    assert loader.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+async def test_version_bump_misses():
+    cache = worker(MemoryCacheBackend())
+    loader = Loader()
+
+    await cache.get_or_load("overview", "u1", loader, version="v1")
+    assert await cache.get_or_load("overview", "u1", loader, version="v2") == {"load": 2}
+    assert await cache.get_or_load("overview", "u1", loader, version="v2") == {"load": 2}
+
+    assert loader.calls == 2
+    assert cache.stats()["superseded"] == 1
+
+
+async def test_version_bump_by_another_worker_misses_local_copy():
+    shared = MemoryCacheBackend()
+    a, b = worker(shared), worker(shared)
+    loader = Loader()
+
+    await a.get_or_load("overview", "u1", loader, version="v1")
+    # b wrote, so readers now ask for v2; a's local v1 copy must not answer
+    await b.get_or_load("overview", "u1", loader, version="v2")
+
+    assert await a.get_or_load("overview", "u1", loader, version="v2") == {"load": 2}
+    assert loader.calls == 2
+
+
+async def test_shared_tier_serves_other_workers():
+    shared = MemoryCacheBackend()
+    a, b = worker(shared), worker(shared)
+    loader = Loader()
+
+    await a.get_or_load("overview", "u1", loader, version="v1")
+
+    assert await b.get_or_load("overview", "u1", loader, version="v1") == {"load": 1}
+    assert loader.calls == 1
+
+
+async def test_stale_entry_is_served_while_one_refresh_runs():
+    cache = worker(MemoryCacheBackend(), ttl=0.01, stale_ttl=60)
+    loader = Loader(delay=0.01)
+
+    await cache.get_or_load("health_report", "u1", loader, version="v1")
+    await asyncio.sleep(0.02)
+    stale = await asyncio.gather(*(cache.get_or_load("health_report", "u1", loader, version="v1") for _ in range(3)))
+    await asyncio.sleep(0.05)
+
+    assert stale == [{"load": 1}] * 3
+    assert cache.stats()["stale_serves"] == 3
+    assert loader.calls == 2
+    assert await cache.get_or_load("health_report", "u1", loader, version="v1") == {"load": 2}
+
+
+async def test_cancelled_caller_does_not_cancel_shared_load():
+    cache = worker(MemoryCacheBackend())
+    loader = Loader(delay=0.02)
+
+    first = asyncio.ensure_future(cache.get_or_load("overview", "u1", loader, version="v1"))
+    second = asyncio.ensure_future(cache.get_or_load("overview", "u1", loader, version="v1"))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == {"load": 1}
+    assert await cache.get_or_load("overview", "u1", loader, version="v1") == {"load": 1}
+    assert loader.calls == 1
+
+
+async def test_failed_load_is_not_cached():
+    cache = worker(MemoryCacheBackend())
+
+    async def failing():
+        raise RuntimeError("database down")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("overview", "u1", failing, version="v1")
+
+    assert await cache.get_or_load("overview", "u1", Loader(), version="v1") == {"load": 1}
+    assert cache.stats()["load_errors"] == 1
+
+
+async def test_invalidate_clears_local_and_shared_tiers():
+    shared = MemoryCacheBackend()
+    a = worker(shared)
+    loader = Loader()
+    await a.get_or_load("overview", "u1", loader, version="v1")
+    await a.get_or_load("health_report", "u1", loader, version="v1")
+
+    await a.invalidate("u1")
+
+    assert await a.local.get(ViewCache.key("overview", "u1")) is None
+    assert await shared.get(ViewCache.key("overview", "u1")) is None
+    assert await shared.get(ViewCache.key("health_report", "u1")) is None
+    assert await worker(shared).get_or_load("overview", "u1", loader, version="v1") == {"load": 3}
+
+
+async def test_local_copy_in_other_worker_expires_after_local_ttl():
+    shared = MemoryCacheBackend()
+    a, b = worker(shared, local_ttl=0.01), worker(shared, local_ttl=0.01)
+    loader = Loader()
+    await a.get_or_load("overview", "u1", loader, version="v1")
+    await b.get_or_load("overview", "u1", loader, version="v1")
+
+    await a.invalidate("u1", "overview")
+    await asyncio.sleep(0.02)
+
+    assert await b.get_or_load("overview", "u1", loader, version="v1") == {"load": 2}
+
+
+async def test_invalidate_during_load_does_not_store_result():
+    cache = worker(MemoryCacheBackend())
+    loader = Loader(delay=0.02)
+
+    pending = asyncio.ensure_future(cache.get_or_load("overview", "u1", loader, version="v1"))
+    await asyncio.sleep(0)
+    await cache.invalidate("u1", "overview")
+
+    assert await pending == {"load": 1}
+    assert await cache.get_or_load("overview", "u1", loader, version="v1") == {"load": 2}
+
+
+async def test_invalidate_many_only_drops_given_users():
+    cache = worker(MemoryCacheBackend())
+    loader = Loader()
+    for user_id in ("u1", "u2", "u3"):
+        await cache.get_or_load("overview", user_id, loader, version="v1")
+
+    await cache.invalidate_many(["u1", "u2", "u1"], "overview")
+
+    assert await cache.get_or_load("overview", "u3", loader, version="v1") == {"load": 3}
+    assert await cache.get_or_load("overview", "u1", loader, version="v1") == {"load": 4}
+    assert cache.stats()["invalidations"] == 2
+
+
+async def test_disabled_cache_always_loads():
+    cache = ViewCache(None, None)
+    loader = Loader()
+
+    await cache.get_or_load("overview", "u1", loader, version="v1")
+    await cache.get_or_load("overview", "u1", loader, version="v1")
+
+    assert loader.calls == 2
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from ledger import (
+    apply_ledger_delta, available_balance, backfill_ledgers, get_ledger, rebuild_ledgers, reserve_withdrawal
+)
+
+pytestmark = pytest.mark.anyio
+
+
+class RacingCollection:
+    """Wraps a collection so `before_aggregate` runs once the rebuild has read the ledger revisions"""
+
+    def __init__(self, collection, before_aggregate):
+        self.collection = collection
+        self.before_aggregate = before_aggregate
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def aggregate(self, pipeline, **kwargs):
+        collection, before = self.collection, self.before_aggregate
+
+        async def rows():
+            await before()
+            async for row in collection.aggregate(pipeline, **kwargs):
+                yield row
+        return rows()
+
+
+async def test_reservation_beyond_available_balance_is_rejected(db):
+    await apply_ledger_delta(db, "u1", commission_approved=100.0, commission_withdrawn=30.0)
+
+    assert not await reserve_withdrawal(db, "u1", 80.0)
+    assert await reserve_withdrawal(db, "u1", 70.0)
+    assert not await reserve_withdrawal(db, "u1", 0.01)
+    assert (await get_ledger(db, "u1"))["withdrawal_pending"] == 70.0
+
+
+async def test_concurrent_reservations_never_overdraw(db):
+    await apply_ledger_delta(db, "u1", commission_approved=100.0)
+
+    granted = await asyncio.gather(*(reserve_withdrawal(db, "u1", 30.0) for _ in range(10)))
+
+    ledger = await get_ledger(db, "u1")
+    assert granted.count(True) == 3
+    assert ledger["withdrawal_pending"] == 90.0
+    assert available_balance(ledger) == 10.0
+
+
+async def test_reservation_builds_a_missing_ledger(db):
+    await db.commissions.insert_one({"user_id": "u1", "status": "approved", "amount": 50.0})
+
+    assert await reserve_withdrawal(db, "u1", 20.0)
+    assert not await reserve_withdrawal(db, "nobody", 1.0)
+    assert (await get_ledger(db, "u1"))["withdrawal_pending"] == 20.0
+
+
+async def test_rebuild_recomputes_and_removes_stale_ledgers(db):
+    await db.purchases.insert_one({"user_id": "u1", "status": "verified", "amount": 40.0})
+    await db.commissions.insert_one({"user_id": "u2", "status": "pending", "amount": 4.0})
+    await db.users.insert_one({"referred_by": "u2"})
+    await apply_ledger_delta(db, "u1", total_spent=999.0)
+    await apply_ledger_delta(db, "gone", total_spent=1.0)
+
+    result = await rebuild_ledgers(db)
+
+    assert result == {"rebuilt": 2, "removed": 1, "skipped": 0}
+    assert (await get_ledger(db, "u1"))["total_spent"] == 40.0
+    assert (await get_ledger(db, "u2"))["commission_pending"] == 4.0
+    assert (await get_ledger(db, "u2"))["referral_count"] == 1
+    assert await db.user_ledgers.find_one({"_id": "gone"}) is None
+
+
+async def test_rebuild_does_not_overwrite_a_racing_delta(db, monkeypatch):
+    await db.commissions.insert_one({"user_id": "u1", "status": "approved", "amount": 100.0})
+    await rebuild_ledgers(db)
+    purchases = db.purchases
+
+    async def verify_purchase():
+        await purchases.insert_one({"user_id": "u1", "status": "verified", "amount": 7.0})
+        await apply_ledger_delta(db, "u1", total_spent=7.0)
+
+    monkeypatch.setattr(db, "purchases", RacingCollection(purchases, verify_purchase), raising=False)
+    result = await rebuild_ledgers(db)
+    monkeypatch.setattr(db, "purchases", purchases, raising=False)
+
+    assert result["skipped"] == 1
+    assert (await get_ledger(db, "u1"))["total_spent"] == 7.0
+    assert (await rebuild_ledgers(db))["skipped"] == 0
+    assert (await get_ledger(db, "u1"))["total_spent"] == 7.0
+
+
+async def test_rebuild_tolerates_a_ledger_created_during_the_run(db, monkeypatch):
+    """The insert loses on the duplicate _id and is reported as skipped"""
+    await db.commissions.insert_one({"user_id": "u1", "status": "approved", "amount": 10.0})
+    purchases = db.purchases
+
+    async def first_write():
+        await apply_ledger_delta(db, "u1", commission_approved=10.0)
+
+    monkeypatch.setattr(db, "purchases", RacingCollection(purchases, first_write), raising=False)
+    result = await rebuild_ledgers(db)
+
+    assert result == {"rebuilt": 0, "removed": 0, "skipped": 1}
+    assert (await get_ledger(db, "u1"))["commission_approved"] == 10.0
+
+
+async def test_backfill_runs_once(db):
+    await db.commissions.insert_one({"user_id": "u1", "status": "approved", "amount": 10.0})
+    # Created by a live write before the backfill, without the history
+    await apply_ledger_delta(db, "u2", total_spent=5.0)
+    await db.purchases.insert_many([
+        {"user_id": "u2", "status": "verified", "amount": 20.0},
+        {"user_id": "u2", "status": "verified", "amount": 5.0},
+    ])
+
+    first = await backfill_ledgers(db)
+    second = await backfill_ledgers(db)
+
+    assert first == {"rebuilt": 2, "removed": 0, "skipped": 0}
+    assert "completed_at" in second
+    assert (await get_ledger(db, "u1"))["commission_approved"] == 10.0
+    assert (await get_ledger(db, "u2"))["total_spent"] == 25.0
@@ -0,0 +1,90 @@
+from datetime import datetime
+import csv
+import io
+
+import pytest
+
+from ledger import apply_ledger_delta, get_ledger
+from payouts import CSV_COLUMNS, create_payout_batch, payout_csv
+
+pytestmark = pytest.mark.anyio
+
+
+async def request_withdrawal(db, user_id: str, amount: float, **fields) -> str:
+    """A pending request with its reservation on the ledger, as the route leaves it"""
+    await apply_ledger_delta(db, user_id, commission_approved=amount, withdrawal_pending=amount)
+    result = await db.withdrawal_requests.insert_one({
+        "user_id": user_id,
+        "amount": amount,
+        "status": "pending",
+        "bank_name": "BCA",
+        "account_number": "1234567890",
+        "account_name": "Budi",
+        "created_at": datetime(2026, 1, 5),
+        **fields
+    })
+    return str(result.inserted_id)
+
+
+async def read_csv(db, batch_id) -> list:
+    return list(csv.reader(io.StringIO("".join([chunk async for chunk in payout_csv(db, batch_id)]))))
+
+
+async def test_batch_pays_each_request_once(db):
+    await request_withdrawal(db, "u1", 40.0)
+    await request_withdrawal(db, "u1", 10.0)
+    await request_withdrawal(db, "u2", 25.0)
+
+    batch = await create_payout_batch(db, "admin", note="minggu 2")
+    again = await create_payout_batch(db, "admin")
+
+    assert batch["withdrawal_count"] == 3
+    assert batch["user_count"] == 2
+    assert batch["total_amount"] == 75.0
+    assert again is None
+    ledger = await get_ledger(db, "u1")
+    assert ledger["withdrawal_pending"] == 0.0
+    assert ledger["commission_withdrawn"] == 50.0
+    assert await db.withdrawal_requests.count_documents({"payout_batch_id": batch["_id"], "status": "paid"}) == 3
+
+
+async def test_batch_only_takes_selected_requests(db):
+    chosen = await request_withdrawal(db, "u1", 40.0)
+    await request_withdrawal(db, "u2", 25.0)
+
+    batch = await create_payout_batch(db, "admin", withdrawal_ids=[chosen, "not-an-id"])
+
+    assert batch["withdrawal_count"] == 1
+    assert (await get_ledger(db, "u2"))["withdrawal_pending"] == 25.0
+
+
+async def test_csv_lists_the_batch(db):
+    user_id = str((await db.users.insert_one({"name": "Budi", "phone_number": "0812"})).inserted_id)
+    withdrawal_id = await request_withdrawal(db, user_id, 40.0)
+    batch = await create_payout_batch(db, "admin")
+
+    rows = await read_csv(db, batch["_id"])
+
+    assert rows == [
+        CSV_COLUMNS,
+        [str(batch["_id"]), withdrawal_id, "BCA", "1234567890", "Budi", "40.00", "Budi", "0812", "2026-01-05T00:00:00"]
+    ]
+
+
+@pytest.mark.parametrize("payload", [
+    "=HYPERLINK(\"http://evil\",\"klik\")",
+    "+62 812",
+    "-2+3",
+    "@SUM(A1:A2)",
+    "\t=1+1",
+    "\r=1+1",
+])
+async def test_csv_neutralizes_formulas(db, payload):
+    user_id = str((await db.users.insert_one({"name": payload, "phone_number": "0812"})).inserted_id)
+    await request_withdrawal(db, user_id, 40.0, account_name=payload, bank_name=payload)
+    batch = await create_payout_batch(db, "admin")
+
+    row = (await read_csv(db, batch["_id"]))[1]
+
+    bank_name, account_name, user_name = row[2], row[4], row[6]
+    assert bank_name == account_name == user_name == "'" + payload
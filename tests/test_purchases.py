@@ -0,0 +1,72 @@
+import pytest
+
+from ledger import get_ledger
+from purchases import COMMISSION_RATE, verify_purchases
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_purchases(db, *amounts):
+    referrer = (await db.users.insert_one({"phone_number": "0811"})).inserted_id
+    buyer = (await db.users.insert_one({"phone_number": "0812", "referred_by": str(referrer)})).inserted_id
+    result = await db.purchases.insert_many([
+        {"user_id": str(buyer), "amount": amount, "status": "pending"} for amount in amounts
+    ])
+    return str(referrer), str(buyer), [str(i) for i in result.inserted_ids]
+
+
+async def test_replayed_batch_pays_commission_once(db):
+    referrer, buyer, (purchase_id,) = await seed_purchases(db, 1000.0)
+    decisions = [{"purchase_id": purchase_id, "approved": True}]
+
+    first = await verify_purchases(db, "admin", decisions)
+    replay = await verify_purchases(db, "admin", decisions)
+
+    assert first[0]["result"] == "verified"
+    assert first[0]["commission"] == {"user_id": referrer, "amount": 1000.0 * COMMISSION_RATE}
+    assert replay[0] == {"purchase_id": purchase_id, "result": "already_processed", "status": "verified"}
+    assert await db.commissions.count_documents({"purchase_id": purchase_id}) == 1
+    assert (await get_ledger(db, referrer))["commission_approved"] == 1000.0 * COMMISSION_RATE
+    assert (await get_ledger(db, buyer))["total_spent"] == 1000.0
+
+
+async def test_batch_reports_invalid_duplicate_and_missing_items(db):
+    _, _, (purchase_id,) = await seed_purchases(db, 50.0)
+    results = await verify_purchases(db, "admin", [
+        {"purchase_id": purchase_id, "approved": False},
+        {"purchase_id": purchase_id, "approved": True},
+        {"purchase_id": "not-an-id", "approved": True},
+        {"purchase_id": "0" * 24, "approved": True},
+    ])
+
+    assert [r["result"] for r in results] == ["cancelled", "duplicate", "invalid_id", "not_found"]
+    assert await db.commissions.count_documents({}) == 0
+
+
+async def test_purchase_taken_by_concurrent_verifier_is_not_paid_twice(db, monkeypatch):
+    """Without transactions only purchases this call moved pay commission"""
+    referrer, buyer, (won, lost) = await seed_purchases(db, 100.0, 200.0)
+    purchases = db.purchases
+
+    class RacingPurchases:
+        """Another verifier approves `lost` just before this call updates it"""
+
+        def __getattr__(self, name):
+            return getattr(purchases, name)
+
+        async def update_one(self, query, update, **kwargs):
+            if str(query["_id"]) == lost:
+                await purchases.update_one({"_id": query["_id"]}, {"$set": {"status": "verified"}})
+            return await purchases.update_one(query, update, **kwargs)
+
+    monkeypatch.setattr(db, "purchases", RacingPurchases(), raising=False)
+    results = await verify_purchases(db, "admin", [
+        {"purchase_id": won, "approved": True},
+        {"purchase_id": lost, "approved": True},
+    ])
+
+    assert results[0]["result"] == "verified"
+    assert results[1] == {"purchase_id": lost, "result": "already_processed", "status": "verified"}
+    assert [c["purchase_id"] async for c in db.commissions.find()] == [won]
+    assert (await get_ledger(db, referrer))["commission_approved"] == 100.0 * COMMISSION_RATE
+    assert (await get_ledger(db, buyer))["total_spent"] == 100.0